@@ -1,6 +1,8 @@
 import os
 import time
 import re
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 from datetime import date, datetime
 from urllib.parse import urljoin
@@ -8,6 +10,21 @@ import requests
 from requests.adapters import HTTPAdapter, Retry
 from dotenv import dotenv_values
 
+try:
+    import aiohttp  # optional: only the async site checks need it
+except ImportError:
+    aiohttp = None
+
+try:
+    import httpx  # optional: HTTP/2 client for the Places API
+except ImportError:
+    httpx = None
+
+try:
+    from orjson import loads as _json_loads  # optional: faster decoding of Places payloads
+except ImportError:
+    from json import loads as _json_loads
+
 # ---------------- Env key management ----------------
 
 def _user_env_dir():
@@ -89,6 +106,8 @@ READ_TIMEOUT = 10
 GOOGLE_TIMEOUT = 15
 SUBPAGE_LIMIT = 6
 TOTAL_SITE_FETCH_TIMEOUT = 18.0
+DETAILS_WORKERS = 10  # concurrent Place Details requests per results page
+SITE_WORKERS = 8      # concurrent park-website probes per results page
 
 DAILY_CSV = "rv_parks_daily_list.csv"
 HISTORY_CSV = "rv_parks_history.csv"
@@ -126,18 +145,21 @@ CONGLOMERATE_KEYWORDS = [
     "jellystone", "yogi bear’s jellystone", "disney fort wilderness"
 ]
 
+CONGLOMERATE_RE = re.compile("|".join(re.escape(k) for k in CONGLOMERATE_KEYWORDS), re.IGNORECASE)
+
 def _is_conglomerate(name: str, website: str) -> bool:
-    s = f"{(name or '').lower()} {(website or '').lower()}"
-    return any(k in s for k in CONGLOMERATE_KEYWORDS)
+    # name-only (website="") works too: the trailing space still lets "koa " match "... KOA"
+    return CONGLOMERATE_RE.search(f"{name or ''} {website or ''}") is not None
 
 # --- Approx "near me" via IP (best-effort) ---
-def get_approx_location_via_ip(timeout=5.0):
+def get_approx_location_via_ip(timeout=5.0, http_session=None):
     """
     Returns (lat, lng) floats or None if not available.
     Uses ipapi.co (no key); fallback to ipinfo.io if needed.
     """
+    http = http_session or session
     try:
-        r = requests.get("https://ipapi.co/json", timeout=timeout)
+        r = http.get("https://ipapi.co/json", timeout=timeout)
         if r.ok:
             j = r.json()
             lat, lon = float(j.get("latitude")), float(j.get("longitude"))
@@ -146,7 +168,7 @@ def get_approx_location_via_ip(timeout=5.0):
     except Exception:
         pass
     try:
-        r = requests.get("https://ipinfo.io/json", timeout=timeout)
+        r = http.get("https://ipinfo.io/json", timeout=timeout)
         if r.ok:
             j = r.json()
             loc = j.get("loc", "")
@@ -157,7 +179,7 @@ def get_approx_location_via_ip(timeout=5.0):
         pass
     return None
 
-def make_session():
+def make_session(pool_connections=10, pool_maxsize=10, pool_block=False):
     s = requests.Session()
     retries = Retry(
         total=3,
@@ -165,7 +187,10 @@ def make_session():
         status_forcelist=[429, 500, 502, 503, 504],
         allowed_methods=["GET"]
     )
-    adapter = HTTPAdapter(max_retries=retries, pool_connections=10, pool_maxsize=10)
+    # pool_block=True makes extra threads wait for a pooled socket to one host
+    # instead of opening (and then discarding) connections beyond pool_maxsize
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize, pool_block=pool_block)
     s.mount("http://", adapter)
     s.mount("https://", adapter)
     s.headers.update({"User-Agent": "Mozilla/5.0"})
@@ -173,6 +198,51 @@ def make_session():
 
 session = make_session()
 
+def make_google_client(max_connections=32):
+    """
+    HTTP/2 client for maps.googleapis.com: concurrent Places calls are multiplexed
+    over a few sockets instead of one socket each. Returns None when httpx or its
+    h2 extra is missing; callers then keep using a requests session.
+    """
+    if httpx is None:
+        return None
+    try:
+        return httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(GOOGLE_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=httpx.HTTPTransport(http2=True, retries=2),
+            headers={"User-Agent": "Mozilla/5.0"},
+        )
+    except ImportError:
+        return None
+
+GOOGLE_RETRY_STATUSES = (429, 500, 502, 503, 504)
+GOOGLE_RETRIES = 3
+GOOGLE_BACKOFF = 0.5  # seconds, doubled per attempt (same schedule as make_session's Retry)
+
+def _google_request(method, url, http_session=None, **kwargs):
+    http = http_session or session
+    is_httpx = httpx is not None and isinstance(http, httpx.Client)
+    if not is_httpx:
+        kwargs["timeout"] = (CONNECT_TIMEOUT, GOOGLE_TIMEOUT)
+    # make_session's urllib3 Retry already covers throttling/5xx on GETs; the HTTP/2
+    # client (and POSTs) only get connection-level retries, so back off here.
+    retry_status = is_httpx or method.upper() != "GET"
+    for attempt in range(GOOGLE_RETRIES + 1):
+        last = attempt == GOOGLE_RETRIES
+        resp = http.request(method, url, **kwargs)
+        if retry_status and resp.status_code in GOOGLE_RETRY_STATUSES and not last:
+            time.sleep(GOOGLE_BACKOFF * (2 ** attempt))
+            continue
+        resp.raise_for_status()
+        data = _json_loads(resp.content)
+        # The legacy API reports throttling in the body with HTTP 200
+        if isinstance(data, dict) and data.get("status") == "OVER_QUERY_LIMIT" and not last:
+            time.sleep(GOOGLE_BACKOFF * (2 ** attempt))
+            continue
+        return data
+
 def ensure_csv(path, columns):
     if not os.path.exists(path):
         pd.DataFrame(columns=columns).to_csv(path, index=False)
@@ -184,6 +254,10 @@ ensure_csv(HISTORY_CSV, [
 ])
 
 history_df = pd.read_csv(HISTORY_CSV, dtype=str)
+# place_id -> row label in history_df; entries first seen this run wait in
+# _history_new and are concatenated once, instead of one concat per append
+_history_index = dict(zip(history_df["park_place_id"].fillna(""), history_df.index))
+_history_new = {}
 
 # ---------------- Helpers ----------------
 
@@ -197,12 +271,22 @@ def _sanitize_url(u: str) -> str:
         return s
     return ""
 
-def google_text_search(api_key, query, location_bias=None, pagetoken=None, latlng=None, radius_m=50000):
+PLACES_TEXTSEARCH_URL = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+PLACES_DETAILS_URL = "https://maps.googleapis.com/maps/api/place/details/json"
+# Only what screening reads: Basic (name/address/components/types) + Contact (website/phones)
+PLACES_DETAILS_FIELDS = (
+    "name,types,formatted_address,website,formatted_phone_number,"
+    "address_components,international_phone_number"
+)
+
+def google_text_search(api_key, query, location_bias=None, pagetoken=None, latlng=None, radius_m=50000,
+                       http_session=None):
     """
     If latlng=(lat,lng) is provided, uses 'location' + 'radius' for better 'near me' results.
     Otherwise falls back to 'query near {location_bias}'.
+    Pass http_session to reuse a caller-owned connection pool (defaults to the module session);
+    a make_google_client() client works too.
     """
-    url = "https://maps.googleapis.com/maps/api/place/textsearch/json"
     params = {"key": api_key}
     if pagetoken:
         params["pagetoken"] = pagetoken
@@ -214,30 +298,98 @@ def google_text_search(api_key, query, location_bias=None, pagetoken=None, latln
             params["radius"] = str(radius_m)   # ~50km default; adjust if you want tighter/wider
         elif location_bias:
             params["query"] = f"{query} near {location_bias}"
-    resp = session.get(url, params=params, timeout=(CONNECT_TIMEOUT, GOOGLE_TIMEOUT))
-    resp.raise_for_status()
-    data = resp.json()
+    data = _google_request("GET", PLACES_TEXTSEARCH_URL, http_session, params=params)
     status = data.get("status")
     if status not in ("OK", "ZERO_RESULTS"):
         raise SystemExit(f"Google Text Search error: {status} — {data.get('error_message')}")
     return data
 
 
-def google_place_details(api_key, place_id):
-    url = "https://maps.googleapis.com/maps/api/place/details/json"
-    fields = (
-        "name,formatted_address,website,formatted_phone_number,"
-        "address_components,international_phone_number"
-    )
-    resp = session.get(url, params={"place_id": place_id, "fields": fields, "key": api_key},
-                       timeout=(CONNECT_TIMEOUT, GOOGLE_TIMEOUT))
-    resp.raise_for_status()
-    data = resp.json()
+def google_place_details(api_key, place_id, http_session=None):
+    data = _google_request("GET", PLACES_DETAILS_URL, http_session,
+                           params={"place_id": place_id, "fields": PLACES_DETAILS_FIELDS, "key": api_key})
     status = data.get("status")
     if status != "OK":
         print(f"[warn] Place details error for {place_id}: {status}")
     return data.get("result", {})
 
+# Places API (New): searchText returns the Details fields we screen on inline
+PLACES_V1_SEARCH_URL = "https://places.googleapis.com/v1/places:searchText"
+PLACES_V1_FIELD_MASK = ",".join([
+    "places.id", "places.displayName", "places.formattedAddress", "places.websiteUri",
+    "places.nationalPhoneNumber", "places.internationalPhoneNumber",
+    "places.addressComponents", "places.types", "places.location", "places.businessStatus",
+    "nextPageToken",
+])
+PLACES_V1_MAX_RADIUS_M = 50000  # locationBias circles are capped at 50 km
+
+def _v1_place_to_legacy(p):
+    det = {
+        "name": (p.get("displayName") or {}).get("text", ""),
+        "formatted_address": p.get("formattedAddress", ""),
+        "website": p.get("websiteUri", ""),
+        "formatted_phone_number": p.get("nationalPhoneNumber", ""),
+        "international_phone_number": p.get("internationalPhoneNumber", ""),
+        "types": p.get("types") or [],
+        "address_components": [
+            {"long_name": comp.get("longText", ""), "short_name": comp.get("shortText", ""),
+             "types": comp.get("types") or []}
+            for comp in p.get("addressComponents") or ()
+        ],
+    }
+    loc = p.get("location") or {}
+    return {"place_id": p.get("id", ""), "name": det["name"], "types": det["types"], "details": det,
+            "business_status": p.get("businessStatus", ""),
+            "geometry": {"location": {"lat": loc.get("latitude"), "lng": loc.get("longitude")}}}
+
+def google_search_text_v1(api_key, query, location_bias=None, pagetoken=None, latlng=None, radius_m=50000,
+                          http_session=None):
+    """
+    Places API (New) searchText with a field mask: one round trip returns the page
+    and each place's details, so no per-place Details call is needed. Returns the
+    google_text_search shape, with each result's Details payload under "details".
+    """
+    body = {"textQuery": f"{query} near {location_bias}" if (location_bias and not latlng) else query,
+            "pageSize": 20}
+    if latlng:
+        lat, lng = latlng
+        body["locationBias"] = {"circle": {"center": {"latitude": lat, "longitude": lng},
+                                           "radius": float(min(radius_m, PLACES_V1_MAX_RADIUS_M))}}
+    if pagetoken:
+        body["pageToken"] = pagetoken
+    data = _google_request("POST", PLACES_V1_SEARCH_URL, http_session, json=body,
+                           headers={"X-Goog-Api-Key": api_key, "X-Goog-FieldMask": PLACES_V1_FIELD_MASK})
+    places = data.get("places") or []
+    return {
+        "status": "OK" if places else "ZERO_RESULTS",
+        "results": [_v1_place_to_legacy(p) for p in places],
+        "next_page_token": data.get("nextPageToken"),
+    }
+
+# address component type -> (output key, which name to take)
+ADDRESS_PARTS = {
+    "locality": ("city", "long_name"),
+    "administrative_area_level_1": ("state", "short_name"),
+    "postal_code": ("zip", "long_name"),
+}
+
+def extract_address_components(det):
+    """
+    Returns {"city", "state", "zip"} from a Place Details payload, stopping
+    as soon as all three have been seen.
+    """
+    out = {"city": "", "state": "", "zip": ""}
+    remaining = len(ADDRESS_PARTS)
+    for comp in det.get("address_components") or ():
+        for t in comp.get("types") or ():
+            part = ADDRESS_PARTS.get(t)
+            if part and not out[part[0]]:
+                out[part[0]] = comp.get(part[1], "")
+                remaining -= 1
+        if remaining <= 0:
+            break
+    return out
+
 def discover_candidate_pages(base_url):
     candidates = ["", "rates", "amenities", "map", "campground-map",
                   "site-map", "camping", "rv", "rv-sites", "rv-camping", "stay", "about"]
@@ -264,9 +416,20 @@ def extract_pad_count(html):
                 return n
     return None
 
-def check_booking_and_pads(website):
+def _scan_site_page(html, booking_hit, pad_found):
+    if not booking_hit:
+        m = BOOKING_RE.search(html)
+        if m:
+            booking_hit = m.group(0)
+    pc = extract_pad_count(html)
+    if pc and (pad_found is None or pc > pad_found):
+        pad_found = pc
+    return booking_hit, pad_found
+
+def check_booking_and_pads(website, http_session=None):
     if not website:
         return (True, "", None)
+    http = http_session or session
     start = time.time()
     pad_found = None
     booking_hit = ""
@@ -274,38 +437,71 @@ def check_booking_and_pads(website):
         if time.time() - start > TOTAL_SITE_FETCH_TIMEOUT:
             break
         try:
-            r = session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            r = http.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
             if r.status_code >= 400 or not r.text:
                 continue
-            html = r.text
-            if not booking_hit:
-                m = BOOKING_RE.search(html)
-                if m:
-                    booking_hit = m.group(0)
-            pc = extract_pad_count(html)
-            if pc and (pad_found is None or pc > pad_found):
-                pad_found = pc
+            booking_hit, pad_found = _scan_site_page(r.text, booking_hit, pad_found)
             if booking_hit and pad_found:
                 break
         except requests.RequestException:
             continue
     return (booking_hit == "", booking_hit, pad_found)
 
+async def check_booking_and_pads_async(http, website):
+    """
+    Same result as check_booking_and_pads, but over a shared aiohttp.ClientSession
+    so many sites can be probed from one event loop. Requires aiohttp.
+    """
+    if not website:
+        return (True, "", None)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    pad_found = None
+    booking_hit = ""
+    for url in discover_candidate_pages(website):
+        if loop.time() - start > TOTAL_SITE_FETCH_TIMEOUT:
+            break
+        try:
+            async with http.get(url, timeout=timeout) as r:
+                if r.status >= 400:
+                    continue
+                html = await r.text(errors="replace")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            continue
+        if not html:
+            continue
+        booking_hit, pad_found = _scan_site_page(html, booking_hit, pad_found)
+        if booking_hit and pad_found:
+            break
+    return (booking_hit == "", booking_hit, pad_found)
+
 def already_seen(place_id):
-    return place_id in (history_df["park_place_id"].fillna("").tolist())
+    return place_id in _history_index or place_id in _history_new
 
-def append_history_entry(entry):
+def _flush_history():
     global history_df
+    if not _history_new:
+        return
+    start = len(history_df)
+    history_df = pd.concat([history_df, pd.DataFrame.from_records(list(_history_new.values()))],
+                           ignore_index=True)
+    _history_index.update((pid, start + i) for i, pid in enumerate(_history_new))
+    _history_new.clear()
+
+def append_history_entry(entry):
     pid = entry["park_place_id"]
-    if pid in history_df["park_place_id"].fillna("").tolist():
-        idx = history_df.index[history_df["park_place_id"] == pid][0]
+    if pid in _history_new:
+        _flush_history()
+    if pid in _history_index:
+        idx = _history_index[pid]
         history_df.at[idx, "last_suggested_on"] = entry.get("last_suggested_on", "")
         prev = history_df.at[idx, "times_suggested"] or "0"
         history_df.at[idx, "times_suggested"] = str(int(prev) + 1)
         if entry.get("pad_count_last_known"):
             history_df.at[idx, "pad_count_last_known"] = str(entry["pad_count_last_known"])
     else:
-        history_df = pd.concat([history_df, pd.DataFrame([entry])], ignore_index=True)
+        _history_new[pid] = entry
 
 def read_existing_authoritative():
     df = pd.DataFrame(columns=COMMON_COLS)
@@ -373,6 +569,7 @@ def write_outputs_preserving(existing_df: pd.DataFrame, daily_rows: list):
     combined = merge_preserving_notes(existing_df, daily_rows)
     combined.to_csv(DAILY_CSV, index=False)
     safe_write_xlsx(combined, DAILY_XLSX)
+    _flush_history()
     history_df.to_csv(HISTORY_CSV, index=False)
     return combined
 
@@ -431,53 +628,72 @@ def generate_daily(api_key: str,
             if token:
                 time.sleep(2.0)
 
+            # Pick this page's candidates first, then fetch their Details concurrently
+            batch = {}
             for r in results:
-                if checked >= MAX_RESULTS_TO_CHECK or len(found) >= daily_target:
+                if checked + len(batch) >= MAX_RESULTS_TO_CHECK:
                     break
                 pid = r.get("place_id")
-                if not pid or already_seen(pid):
+                if not pid or pid in batch or already_seen(pid):
                     continue
-                checked += 1
                 name_preview = r.get("name", "")
+                # Reject obvious chains by name before paying for a Details call
+                if avoid_conglomerates and _is_conglomerate(name_preview, ""):
+                    continue
+                batch[pid] = name_preview
+            details = []
+            if batch:
+                with ThreadPoolExecutor(max_workers=DETAILS_WORKERS) as pool:
+                    details = list(pool.map(lambda pid: google_place_details(api_key, pid), batch))
+
+            screened = []
+            for (pid, name_preview), det in zip(batch.items(), details):
+                checked += 1
                 emit(f"    [check {checked}/{MAX_RESULTS_TO_CHECK}] {name_preview}")
 
-                det = google_place_details(api_key, pid)
                 name = det.get("name", name_preview)
                 website = _sanitize_url(det.get("website", ""))
                 phone = det.get("formatted_phone_number", "") or det.get("international_phone_number", "") or ""
                 addr = det.get("formatted_address", "") or ""
-                comps = {"city":"", "state":"", "zip":""}
-                for comp in det.get("address_components", []) or []:
-                    types = comp.get("types", [])
-                    if "locality" in types:  comps["city"] = comp.get("long_name","")
-                    if "administrative_area_level_1" in types:  comps["state"] = comp.get("short_name","")
-                    if "postal_code" in types:  comps["zip"] = comp.get("long_name","")
-
-                # (optional) conglomerate skip here if you added it
-                # if avoid_conglomerates and _is_conglomerate(name, website): ... continue
-
-                no_booking, booking_hit, pad_count = check_booking_and_pads(website)
-                qualifies = no_booking and (pad_count is None or pad_count >= PAD_MIN)
-
-                append_history_entry({
-                    "park_place_id": pid, "park_name": name, "website": website, "phone": phone,
-                    "address": addr, "city": comps["city"], "state": comps["state"], "zip": comps["zip"],
-                    "first_seen": today, "last_suggested_on": today if qualifies else "",
-                    "times_suggested": "1" if qualifies else "0", "ever_called": "",
-                    "ever_contacted": "", "pad_count_last_known": str(pad_count) if pad_count is not None else ""
-                })
-
-                if qualifies:
-                    found.append({
-                        "park_place_id": pid, "date_generated": today, "park_name": name, "phone": phone,
-                        "website": website, "address": addr, "city": comps["city"], "state": comps["state"],
-                        "zip": comps["zip"], "owner_name": "", "owner_phone": "", "owner_email": "",
-                        "source": "Google Places", "booking_detected": False if not booking_hit else True,
-                        "detected_keyword": booking_hit, "pad_count": pad_count if pad_count is not None else "",
-                        "notes": "Pad count inferred from site" if pad_count else "Verify pad count by phone",
-                        "call_status": "", "outcome": "", "follow_up_date": ""
+                comps = extract_address_components(det)
+
+                # Second pass: some brands only show up in the website
+                if avoid_conglomerates and _is_conglomerate(name, website):
+                    continue
+                screened.append((pid, name, website, phone, addr, comps))
+
+            # Website probes run concurrently; stop taking results once the target is met
+            pool = ThreadPoolExecutor(max_workers=SITE_WORKERS)
+            futs = {pool.submit(check_booking_and_pads, item[2]): item for item in screened}
+            try:
+                for fut in as_completed(futs):
+                    if len(found) >= daily_target:
+                        break
+                    pid, name, website, phone, addr, comps = futs[fut]
+                    no_booking, booking_hit, pad_count = fut.result()
+                    qualifies = no_booking and (pad_count is None or pad_count >= PAD_MIN)
+
+                    append_history_entry({
+                        "park_place_id": pid, "park_name": name, "website": website, "phone": phone,
+                        "address": addr, "city": comps["city"], "state": comps["state"], "zip": comps["zip"],
+                        "first_seen": today, "last_suggested_on": today if qualifies else "",
+                        "times_suggested": "1" if qualifies else "0", "ever_called": "",
+                        "ever_contacted": "", "pad_count_last_known": str(pad_count) if pad_count is not None else ""
                     })
-                    emit(f"      [keep] {name} (pads: {pad_count if pad_count else 'unknown'}, no booking: {not booking_hit})")
+
+                    if qualifies:
+                        found.append({
+                            "park_place_id": pid, "date_generated": today, "park_name": name, "phone": phone,
+                            "website": website, "address": addr, "city": comps["city"], "state": comps["state"],
+                            "zip": comps["zip"], "owner_name": "", "owner_phone": "", "owner_email": "",
+                            "source": "Google Places", "booking_detected": False if not booking_hit else True,
+                            "detected_keyword": booking_hit, "pad_count": pad_count if pad_count is not None else "",
+                            "notes": "Pad count inferred from site" if pad_count else "Verify pad count by phone",
+                            "call_status": "", "outcome": "", "follow_up_date": ""
+                        })
+                        emit(f"      [keep] {name} (pads: {pad_count if pad_count else 'unknown'}, no booking: {not booking_hit})")
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
 
             if not token or checked >= MAX_RESULTS_TO_CHECK or len(found) >= daily_target:
                 break
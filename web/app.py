@@ -1,30 +1,51 @@
 from __future__ import annotations
 
+import asyncio
+import atexit
+import hashlib
+import hmac
 import io
 import os
 import pathlib
+import re
 import sys
+import threading
 import traceback
 import uuid
 from typing import Any, Dict, List
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
 import pandas as pd
 import streamlit as st
 import extra_streamlit_components as stx
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+try:
+    import aiohttp  # optional: async website probes; falls back to the thread pool
+except ImportError:
+    aiohttp = None
 
 # =============================================================================
 # Tunables / Perf (override via env without redeploy)
 # =============================================================================
 WORKERS = int(os.getenv("RVP_WORKERS", "20"))
+# Threads per HTTP stage pool: they spend their time blocked on sockets (GIL released)
+IO_WORKERS = int(os.getenv("RVP_IO_WORKERS", str(max(32, WORKERS))))
 DEFAULT_NEAR_ME_RADIUS_M = int(os.getenv("RVP_RADIUS_M", "25000"))
 TARGET_QUERY_LIMIT = int(os.getenv("RVP_QUERY_LIMIT", "999"))
 PAGE_SLEEP_SECS = float(os.getenv("RVP_PAGE_SLEEP", "2.2"))
 PAD_HTTP_TIMEOUT = float(os.getenv("RVP_PAD_HTTP_TIMEOUT", "5.0"))
+IP_LOCATION_TTL_SECS = int(os.getenv("RVP_IP_LOCATION_TTL", "1800"))
+# Max in-flight website probes when aiohttp is available
+SITE_CONCURRENCY = int(os.getenv("RVP_SITE_CONCURRENCY", "64"))
+# Use Places API (New) searchText, which returns details inline (no per-place Details call)
+PLACES_V1 = os.getenv("RVP_PLACES_V1", "false").strip().lower() == "true"
 
 PAGE_SIZE_HISTORY = 20
+# PostgREST's default max-rows: a history id list this long may be truncated
+HISTORY_SET_MAX = 1000
 SEARCH_HARD_CAP   = 100
 
 # Expanding “near me” radii (meters). Can override via env/Secrets:
@@ -36,11 +57,21 @@ NEARME_RADII = [int(x) for x in os.getenv(
 # Cookie security (True on HTTPS like Streamlit Cloud; False for localhost dev)
 COOKIE_SECURE   = os.getenv("RVP_COOKIE_SECURE", "false").strip().lower() == "true"
 COOKIE_SAMESITE = os.getenv("RVP_COOKIE_SAMESITE", "Lax")
+# Lifetime of the signed unlock-status cookie before Supabase is consulted again
+TIER_COOKIE_TTL_SECS = int(os.getenv("RVP_TIER_TTL_SECS", "3600"))
+# How long a session trusts its unlock flag before asking Supabase again
+UNLOCK_RECHECK_SECS = int(os.getenv("RVP_UNLOCK_RECHECK_SECS", "300"))
 
 # =============================================================================
 # Secrets -> env (for Streamlit Cloud)
 # =============================================================================
+@st.cache_resource(show_spinner=False)
 def _secrets_to_env():
+    """Copy Streamlit secrets into os.environ, once per process."""
+    try:
+        secrets = dict(st.secrets)  # one parse of secrets.toml
+    except Exception:  # no secrets file (local dev)
+        return
     mappings = {
         "GOOGLE_PLACES_API_KEY": ["GOOGLE_PLACES_API_KEY", "GOOGLE_MAPS_API_KEY", "GOOGLE_API_KEY"],
         "SUPABASE_URL": ["SUPABASE_URL"],
@@ -48,53 +79,35 @@ def _secrets_to_env():
         "SUPABASE_SERVICE_ROLE_KEY": ["SUPABASE_SERVICE_ROLE_KEY", "SERVICE_ROLE_KEY"],
         "SIGNUP_URL": ["SIGNUP_URL"],
         "DONATE_URL": ["DONATE_URL"],
+        "RVP_COOKIE_SECRET": ["RVP_COOKIE_SECRET", "COOKIE_SECRET"],
     }
     for env_name, candidates in mappings.items():
         if os.getenv(env_name):
             continue
-        for key in candidates:
-            try:
-                val = st.secrets.get(key)
-            except Exception:
-                val = None
-            if val:
-                os.environ[env_name] = str(val)
-                break
+        val = next((secrets[key] for key in candidates if secrets.get(key)), None)
+        if val:
+            os.environ[env_name] = str(val)
 _secrets_to_env()
 
 SIGNUP_URL = os.getenv("SIGNUP_URL", "").strip()
 DONATE_URL = os.getenv("DONATE_URL", "").strip()
+TIER_COOKIE_SECRET = os.getenv("RVP_COOKIE_SECRET", "").strip()
 
 # =============================================================================
 # Path setup so Python can find web/ and src/
 # =============================================================================
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 SRC_DIR = ROOT / "src"
-if str(ROOT) not in sys.path:
-    sys.path.insert(0, str(ROOT))
-if str(SRC_DIR) not in sys.path:
-    sys.path.insert(0, str(SRC_DIR))
 
 # =============================================================================
-# ✅ Safe import of web.db (works whether web is a package or not)
+# ✅ Import of web.db, once per process (web/ ships its __init__.py)
 # =============================================================================
+@st.cache_resource(show_spinner=False)
 def _import_web_db():
-    try:
-        import web.db as dbmod           # prefer package import
-        return dbmod
-    except Exception:
-        pass
-    import importlib.util, types
-    web_dir = ROOT / "web"
-    db_path = web_dir / "db.py"
-    if not db_path.exists():
-        raise RuntimeError(f"Could not find web/db.py at {db_path}")
-    spec = importlib.util.spec_from_file_location("web.db", db_path)
-    dbmod = importlib.util.module_from_spec(spec)
-    sys.modules.setdefault("web", types.ModuleType("web"))
-    sys.modules["web.db"] = dbmod
-    assert spec.loader is not None
-    spec.loader.exec_module(dbmod)
+    for p in (ROOT, SRC_DIR):
+        if str(p) not in sys.path:
+            sys.path.insert(0, str(p))
+    import web.db as dbmod
     return dbmod
 
 try:
@@ -115,15 +128,39 @@ record_signup   = getattr(db, "record_signup", None)
 grant_unlimited = getattr(db, "grant_unlimited", None)
 list_history_rows = getattr(db, "list_history_rows", None)
 list_history_all  = getattr(db, "list_history_all", None)
+history_pids_contains = getattr(db, "history_pids_contains", None)
+fetch_history_place_ids = getattr(db, "fetch_history_place_ids", None)
+get_cached_details     = getattr(db, "get_cached_details", None)
+put_cached_details     = getattr(db, "put_cached_details", None)
+get_cached_text_search = getattr(db, "get_cached_text_search", None)
+put_cached_text_search = getattr(db, "put_cached_text_search", None)
+record_history_and_increment = getattr(db, "record_history_and_increment", None)
+get_cached_site_checks = getattr(db, "get_cached_site_checks", None)
+put_cached_site_checks = getattr(db, "put_cached_site_checks", None)
+
+def _user_key(email: str) -> str:
+    """History rows are keyed by the lowercased email (as db.py writes them): plain equality, index-friendly."""
+    return (email or "").strip().lower()
 
 # If a deployed db.py didn’t implement pagination helpers, fall back
+# Keyset pagination: `before=(created_at, park_place_id)` of the last row already
+# shown, so deep pages cost the same as the first one (no OFFSET walk). Backed by
+# an index on history (email, created_at desc, park_place_id desc).
 if list_history_rows is None:
-    def list_history_rows(sb, user_key: str, limit: int = 1000, offset: int = 0):
-        return (
+    def list_history_rows(sb, user_key: str, limit: int = 1000, offset: int = 0,
+                          before: tuple[str, str] | None = None):
+        q = (
             sb.table("history")
             .select("created_at, park_place_id, park_name, phone, website, address, city, state, zip, source, detected_keyword, pad_count")
-            .ilike("email", user_key)
-            .order("created_at", desc=True)
+            .eq("email", _user_key(user_key))
+        )
+        if before:
+            ts, pid = before
+            q = q.or_(f'created_at.lt."{ts}",and(created_at.eq."{ts}",park_place_id.lt."{pid}")')
+            offset = 0
+        return (
+            q.order("created_at", desc=True)
+            .order("park_place_id", desc=True)
             .range(offset, offset + limit - 1)
             .execute()
             .data or []
@@ -131,23 +168,27 @@ if list_history_rows is None:
 if list_history_all is None:
     def list_history_all(sb, user_key: str) -> list[dict]:
         out: list[dict] = []
-        page_size, offset = 1000, 0
+        page_size, before = 1000, None
         while True:
-            resp = (
-                sb.table("history")
-                .select("created_at, park_place_id, park_name, phone, website, address, city, state, zip, source, detected_keyword, pad_count")
-                .ilike("email", user_key)
-                .order("created_at", desc=True)
-                .range(offset, offset + page_size - 1)
-                .execute()
-            )
-            rows = resp.data or []
+            rows = list_history_rows(sb, user_key, limit=page_size, before=before)
             out.extend(rows)
             if len(rows) < page_size:
                 break
-            offset += page_size
+            before = (rows[-1]["created_at"], rows[-1]["park_place_id"])
         return out
 
+if history_pids_contains is None:
+    def history_pids_contains(sb, email: str, pids: list[str]) -> set[str]:
+        pids = [p for p in dict.fromkeys(pids) if p]
+        if not pids:
+            return set()
+        rows = (
+            sb.table("history").select("park_place_id")
+            .eq("email", _user_key(email)).in_("park_place_id", pids)
+            .execute().data or []
+        )
+        return {row["park_place_id"] for row in rows if row.get("park_place_id")}
+
 # Import core after sys.path updates
 from rvprospector import core as c  # noqa: E402
 
@@ -163,33 +204,40 @@ if DONATE_URL:
 else:
     st.sidebar.caption("Set DONATE_URL to show a donate button.")
 
+# Near-me searches reuse the session's IP lookup; this forces a fresh one (e.g. after travelling)
+if st.sidebar.button("📍 Refresh my location"):
+    st.session_state.pop("_ip_latlng", None)
+
 # =============================================================================
 # COOKIE + URL HELPERS
 # =============================================================================
+def _cookie_cache_put(key: str, value: str | None):
+    """Keep the session's cookie snapshot in sync with writes made this session."""
+    cache = st.session_state.get("_cookies_cache")
+    if cache is None:
+        return
+    if value is None:
+        cache.pop(key, None)
+    else:
+        cache[key] = value
+
 def _cm_set(cm: stx.CookieManager, key: str, value: str):
+    _cookie_cache_put(key, value)
     expires_at = datetime.utcnow() + timedelta(days=180)
+    # Every write needs its own component key: several cookies are written in one
+    # rerun, and the component's default key="set" would collide (DuplicateWidgetID).
     try:
-        cm.set(key, value, expires_at=expires_at, key=key, path="/",
-               secure=COOKIE_SECURE, samesite=COOKIE_SAMESITE)
-        return
-    except TypeError:
-        pass
-    try:
-        cm.set(key, value, expiry_days=180, key=key, path="/",
-               secure=COOKIE_SECURE, samesite=COOKIE_SAMESITE)
-        return
-    except TypeError:
-        pass
-    cm.set(key, value)
+        cm.set(key, value, key=f"set_{key}", expires_at=expires_at, path="/",
+               secure=COOKIE_SECURE, same_site=COOKIE_SAMESITE)
+    except TypeError:  # older/newer component signatures
+        cm.set(key, value, key=f"set_{key}", expires_at=expires_at)
 
 def _cm_delete(cm: stx.CookieManager, key: str):
+    _cookie_cache_put(key, None)
     try:
-        cm.delete(key, key=key, path="/")
+        cm.delete(key, key=f"delete_{key}")
     except TypeError:
-        try:
-            cm.delete(key)
-        except Exception:
-            _cm_set(cm, key, "")
+        _cm_set(cm, key, "")
 
 def _ensure_guest_cookie(cm: stx.CookieManager, cookies: Dict[str, str]) -> str:
     gid = cookies.get("rvp_guest_id")
@@ -198,10 +246,38 @@ def _ensure_guest_cookie(cm: stx.CookieManager, cookies: Dict[str, str]) -> str:
         _cm_set(cm, "rvp_guest_id", gid)
     return f"guest:{gid}"
 
+def _tier_signature(email: str, unlocked: bool, exp: int) -> str:
+    msg = f"{email}|{int(unlocked)}|{exp}".encode("utf-8")
+    return hmac.new(TIER_COOKIE_SECRET.encode("utf-8"), msg, hashlib.sha256).hexdigest()
+
+def _set_tier_claim(cm: stx.CookieManager, email: str, unlocked: bool):
+    if not TIER_COOKIE_SECRET:
+        return
+    exp = int(time.time()) + TIER_COOKIE_TTL_SECS
+    _cm_set(cm, "rvp_tier", f"{int(unlocked)}|{exp}|{_tier_signature(email, unlocked, exp)}")
+
+def _read_tier_claim(cookies: Dict[str, str], email: str) -> bool | None:
+    """Signed unlock flag for `email`, or None when missing, expired or forged."""
+    if not TIER_COOKIE_SECRET:
+        return None
+    try:
+        flag, exp_raw, sig = (cookies.get("rvp_tier") or "").split("|", 2)
+        unlocked, exp = flag == "1", int(exp_raw)
+    except ValueError:
+        return None
+    if exp < time.time():
+        return None
+    if not hmac.compare_digest(sig, _tier_signature(email, unlocked, exp)):
+        return None
+    return unlocked
+
 def _set_signed_in(cm: stx.CookieManager, email: str, unlocked: bool):
+    email = _user_key(email)
     st.session_state["user_key"] = email
     st.session_state["unlocked"] = bool(unlocked)
+    st.session_state["_unlocked_checked_at"] = time.time()
     _cm_set(cm, "rvp_email", email)
+    _set_tier_claim(cm, email, bool(unlocked))
 
 def _set_url_email(email: str):
     try:
@@ -219,6 +295,8 @@ def _get_url_email() -> str | None:
 
 def _sign_out(cm: stx.CookieManager):
     _cm_delete(cm, "rvp_email")
+    _cm_delete(cm, "rvp_tier")
+    _cached_is_unlocked.clear()
     try:
         st.query_params.update({"u": ""})
     except Exception:
@@ -240,36 +318,290 @@ US_STATES = {
     "TN": "Tennessee", "TX": "Texas", "UT": "Utah", "VT": "Vermont", "VA": "Virginia", "WA": "Washington",
     "WV": "West Virginia", "WI": "Wisconsin", "WY": "Wyoming", "DC": "District of Columbia"
 }
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def _geohash7(lat: float, lng: float) -> str:
+    """Minimal 7-char geohash (~150 m cell) used to bucket "near me" searches."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    out: list[str] = []
+    ch, bits, even = 0, 0, True
+    while len(out) < 7:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng > mid:
+                ch, lng_lo = (ch << 1) | 1, mid
+            else:
+                ch, lng_hi = ch << 1, mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat > mid:
+                ch, lat_lo = (ch << 1) | 1, mid
+            else:
+                ch, lat_hi = ch << 1, mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_GEOHASH_BASE32[ch])
+            ch, bits = 0, 0
+    return "".join(out)
+
+_STATE_NAME_TO_ABBR = {v.lower(): k for k, v in US_STATES.items()}
+
 def normalize_location(raw: str) -> str:
     s = (raw or "").strip()
     if not s:
         return ""
-    if len(s) == 2 and s.upper() in US_STATES:
-        return f"{US_STATES[s.upper()]}, USA"
-    if s.title() in US_STATES.values() and "usa" not in s.lower():
-        return f"{s.title()}, USA"
+    up = s.upper()
+    if len(s) == 2 and up in US_STATES:
+        return f"{US_STATES[up]}, USA"
+    abbr = _STATE_NAME_TO_ABBR.get(s.lower())
+    if abbr:
+        return f"{US_STATES[abbr]}, USA"
     return s
 
 # =============================================================================
 # Cached calls
 # =============================================================================
-@st.cache_data(ttl=3600, show_spinner=False)
-def _cached_place_details(api_key: str, pid: str) -> Dict[str, Any]:
-    return c.google_place_details(api_key, pid)
+@st.cache_resource(show_spinner=False)
+def _sb():
+    """One Supabase client (and its HTTP pool) per process instead of one per call."""
+    return get_client()
+
+@st.cache_resource(show_spinner=False)
+def _pool(stage: str) -> ThreadPoolExecutor:
+    """Long-lived worker pool per pipeline stage ("details", "sites", "pages", "writes"), shared across reruns."""
+    size = 2 if stage == "writes" else IO_WORKERS
+    ex = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"rvp-{stage}")
+    atexit.register(ex.shutdown, wait=False)
+    return ex
+
+@st.cache_resource(show_spinner=False)
+def _http():
+    """One keep-alive connection pool shared by every worker thread and rerun."""
+    return c.make_session(pool_connections=32, pool_maxsize=max(64, 2 * IO_WORKERS), pool_block=True)
+
+@st.cache_resource(show_spinner=False)
+def _google_http():
+    """HTTP/2 client for the Places API when httpx[http2] is available, else the shared pool."""
+    make = getattr(c, "make_google_client", None)
+    return (make(max_connections=max(32, IO_WORKERS)) if make else None) or _http()
+
+# Both layers below sit on top of a Supabase table cache (see web/db.py) so
+# results survive restarts and are shared between users. `persist=False`
+# still reads the shared cache but never writes to it (guest searches).
+# Shared-cache reads for details are batched per page in _generate_for_user.
+# The leading underscore keeps the API key out of the cache key: rotating it
+# doesn't drop cached places, and every lookup hashes less.
+@st.cache_data(ttl=86400, max_entries=20000, show_spinner=False)
+def _cached_place_details(_api_key: str, pid: str, persist: bool = True) -> Dict[str, Any]:
+    det = c.google_place_details(_api_key, pid, http_session=_google_http())
+    if not det:
+        # Quota/timeout/error responses come back empty; raising keeps them out of every cache
+        raise RuntimeError(f"no Place Details returned for {pid}")
+    if persist and put_cached_details:
+        try:
+            put_cached_details(_sb(), pid, det)
+        except Exception:
+            pass
+    return det
+
+@st.cache_resource(show_spinner=False)
+def _inflight() -> tuple[threading.Lock, dict]:
+    """Process-wide registry of in-flight calls, for _coalesced."""
+    return threading.Lock(), {}
+
+def _coalesced(kind: str, key: str, fn, *args):
+    """Run fn(*args) once per (kind, key) at a time; concurrent callers wait for and share that result."""
+    lock, calls = _inflight()
+    with lock:
+        fut = calls.get((kind, key))
+        owner = fut is None
+        if owner:
+            fut = calls[(kind, key)] = Future()
+    if owner:
+        try:
+            fut.set_result(fn(*args))
+        except Exception as e:
+            fut.set_exception(e)
+        finally:
+            with lock:
+                calls.pop((kind, key), None)
+    return fut.result()
+
+DETAILS_MEMO_MAX = 20000
+DETAILS_MEMO_TTL_SECS = 86400  # same lifetime as _cached_place_details
+
+@st.cache_resource(show_spinner=False)
+def _details_memo() -> dict[str, tuple[float, Dict[str, Any]]]:
+    """place_id -> (stored at, Details payload) seen by this process; checked inline before any pool or Supabase work."""
+    return {}
+
+def _memo_get_details(pid: str) -> Dict[str, Any] | None:
+    entry = _details_memo().get(pid)
+    if entry is None:
+        return None
+    if time.time() - entry[0] > DETAILS_MEMO_TTL_SECS:
+        _details_memo().pop(pid, None)
+        return None
+    return entry[1]
+
+def _memo_details(pid: str, det: Dict[str, Any]) -> None:
+    if not det:
+        return  # an empty payload is an error response, not a place
+    memo = _details_memo()
+    if len(memo) >= DETAILS_MEMO_MAX:
+        memo.pop(next(iter(memo)), None)  # oldest first
+    memo[pid] = (time.time(), det)
+
+def _site_key(url: str) -> str:
+    """Website -> cache key: host without www. plus path, ignoring scheme, query and trailing slash."""
+    u = urlsplit(url or "")
+    host = u.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return f"{host}{u.path.rstrip('/')}" if host else ""
+
+def _text_search_cache_key(query: str, location_bias: str | None, pagetoken: str | None,
+                           latlng: tuple[float, float] | None, radius_m: int) -> str:
+    ll = f"{latlng[0]:.2f},{latlng[1]:.2f}" if latlng else ""
+    raw = "|".join([query, location_bias or "", pagetoken or "", ll, str(radius_m), "v1" if PLACES_V1 else ""])
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+@st.cache_resource(ttl=86400, show_spinner=False)
+def _api_key() -> str:
+    """Places API key; main() clears this when it is empty so a key added later is picked up."""
+    return c.load_api_key()
+
+def _ip_latlng() -> tuple[float, float] | None:
+    """IP-based location, looked up at most once per IP_LOCATION_TTL_SECS per session."""
+    cached = st.session_state.get("_ip_latlng")
+    if cached and time.time() - cached[1] < IP_LOCATION_TTL_SECS:
+        return cached[0]
+    latlng = c.get_approx_location_via_ip(http_session=_http())
+    if latlng:
+        st.session_state["_ip_latlng"] = (latlng, time.time())
+    return latlng
+
+# Unlock status changes only on sign-up/activation; both paths clear this cache.
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_is_unlocked(email: str) -> bool:
+    return bool(is_unlocked(_sb(), email))
+
+@st.cache_resource(ttl=86400, show_spinner=False)
+def _recent_pids(email: str, bucket: str, avoid_conglomerates: bool) -> set[str]:
+    """
+    Mutable per-(user, geohash cell, filter settings) set of place_ids evaluated
+    in the last day; a verdict reached under one setting never hides a park under another.
+    """
+    return set()
 
-@st.cache_data(ttl=600, show_spinner=False)
-def _cached_text_search(api_key: str, query: str, location_bias: str | None,
-                        pagetoken: str | None, latlng: tuple[float, float] | None,
-                        radius_m: int) -> dict:
-    return c.google_text_search(
+def _history_pids(user_key: str) -> tuple[set[str], bool]:
+    """
+    This session's copy of the user's history place_ids, loaded once per sign-in
+    and kept current by searches. The flag says the set is complete, so
+    searches can skip the per-page history check entirely.
+    """
+    store = st.session_state.setdefault("_history_pids", {})
+    if user_key not in store:
+        pids: set[str] = set()
+        complete = False
+        if fetch_history_place_ids:
+            try:
+                pids = set(fetch_history_place_ids(_sb(), user_key))
+                complete = len(pids) < HISTORY_SET_MAX
+            except Exception:
+                pass
+        store[user_key] = (pids, complete)
+    return store[user_key]
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def _history_page(user_key: str, before: tuple[str, str] | None, limit: int) -> list[dict]:
+    """One keyset page of history; pager clicks and reruns reuse it for a minute."""
+    return list_history_rows(_sb(), user_key, limit=limit, before=before)
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def _history_count(user_key: str) -> int | None:
+    """Total history rows (count='exact', one row transferred); None if the count is unavailable."""
+    res = (
+        _sb().table("history").select("park_place_id", count="exact")
+        .eq("email", _user_key(user_key)).limit(1).execute()
+    )
+    return getattr(res, "count", None)
+
+def _save_search(sb, user_key: str, rows: List[Dict[str, Any]], count_leads: bool) -> None:
+    """
+    Persist a finished search off the script thread: history upsert, then the demo
+    counter. Failures propagate through the future to _collect_pending_save.
+    """
+    try:
+        if count_leads and record_history_and_increment:
+            record_history_and_increment(sb, user_key, rows, len(rows))  # one RPC round-trip
+        else:
+            record_history(sb, user_key, rows)  # expects batch insert: one upsert for the whole list
+            if count_leads:
+                increment_leads(sb, user_key, len(rows))
+    finally:
+        _history_page.clear()
+        _history_count.clear()
+
+def _collect_pending_save(wait: bool) -> None:
+    """
+    Settle the previous search's background save: on success its place_ids join the
+    session's history set, on failure the user is warned. With wait=False an
+    unfinished save is left for a later rerun.
+    """
+    pending = st.session_state.get("_pending_save")
+    if pending is None:
+        return
+    fut, user_key, pids = pending
+    if not wait and not fut.done():
+        return
+    st.session_state.pop("_pending_save", None)
+    try:
+        fut.result()
+    except Exception as e:
+        traceback.print_exc()
+        st.warning(f"Your last search could not be saved to your history: {e}")
+        return
+    _history_pids(user_key)[0].update(pids)
+
+def _text_search_live(api_key: str, query: str, location_bias: str | None,
+                      pagetoken: str | None, latlng: tuple[float, float] | None, radius_m: int) -> dict:
+    search = c.google_search_text_v1 if PLACES_V1 else c.google_text_search
+    return search(
         api_key=api_key,
         query=query,
         location_bias=location_bias,
         pagetoken=pagetoken,
         latlng=latlng,
         radius_m=radius_m,
+        http_session=_google_http(),
     )
 
+@st.cache_data(ttl=600, show_spinner=False)
+def _cached_text_search(_api_key: str, query: str, location_bias: str | None,
+                        pagetoken: str | None, latlng: tuple[float, float] | None,
+                        radius_m: int, persist: bool = True) -> dict:
+    sb = _sb()
+    key = _text_search_cache_key(query, location_bias, pagetoken, latlng, radius_m)
+    if get_cached_text_search and not pagetoken:
+        try:
+            hit = get_cached_text_search(sb, key)
+        except Exception:
+            hit = None
+        if hit:
+            return hit
+    data = _text_search_live(_api_key, query, location_bias, pagetoken, latlng, radius_m)
+    # Page tokens expire within minutes, so only complete, token-free first pages
+    # go to the day-long shared cache; anything else would hand out a dead token.
+    if persist and put_cached_text_search and not pagetoken and not data.get("next_page_token"):
+        try:
+            put_cached_text_search(sb, key, data)
+        except Exception:
+            pass
+    return data
+
 # =============================================================================
 # Strict category filter
 # =============================================================================
@@ -284,22 +616,53 @@ REJECT_KEYWORDS = (
     "storage", "repair", "sales", "dealers", "dealer", "parts",
     "boat", "marina",
 )
+# Websites on these hosts are listings/OTAs, not the park's own site
+OTA_HOST_SNIPPETS = (
+    "booking.com", "expedia", "hotels.com", "koa.com", "goodsam.com",
+    "campendium", "reserveamerica", "hipcamp", "rvshare", "roverpass",
+    "recreation.gov", "usace.army.mil",
+)
+_OTA_RE = re.compile("|".join(re.escape(sn) for sn in OTA_HOST_SNIPPETS), re.IGNORECASE)
+
+_ALLOW_RE = re.compile("|".join(re.escape(k) for k in ALLOW_KEYWORDS), re.IGNORECASE)
+_REJECT_RE = re.compile("|".join(re.escape(k) for k in REJECT_KEYWORDS), re.IGNORECASE)
+
 def _looks_like_rv_or_mhp(name: str, types: list[str] | None) -> bool:
-    nm = (name or "").lower()
+    nm = name or ""
     tset = set((types or []))
     if "rv_park" in tset:
         return True
-    if ("park" in tset or "tourist_attraction" in tset) and not any(k in nm for k in ALLOW_KEYWORDS):
+    allowed = _ALLOW_RE.search(nm) is not None
+    if ("park" in tset or "tourist_attraction" in tset) and not allowed:
         return False
     if ("campground" in tset or "lodging" in tset):
-        return any(k in nm for k in ALLOW_KEYWORDS)
-    if any(k in nm for k in ALLOW_KEYWORDS):
-        return not any(bad in nm for bad in REJECT_KEYWORDS)
+        return allowed
+    if allowed:
+        return _REJECT_RE.search(nm) is None
     return False
 
 # =============================================================================
 # Search core (with expanding-radius “near me”)
 # =============================================================================
+NEAR_CELLS_PER_DEGREE = 2000  # 1/2000° ≈ 55 m of latitude
+
+def _near_cell(result: Dict[str, Any]) -> tuple[int, int, str] | None:
+    """
+    Text Search result -> (~50 m grid cell, normalized name), or None without
+    coordinates. Only a same-named listing in the same cell counts as a duplicate;
+    distinct neighbouring parks differ by name.
+    """
+    loc = (result.get("geometry") or {}).get("location") or {}
+    lat, lng = loc.get("lat"), loc.get("lng")
+    if lat is None or lng is None:
+        return None
+    name = re.sub(r"\W+", "", (result.get("name") or "").lower())
+    return (round(lat * NEAR_CELLS_PER_DEGREE), round(lng * NEAR_CELLS_PER_DEGREE), name)
+
+class _Done(Exception):
+    """Raised inside _generate_for_user once the requested number of parks is found."""
+
+
 def _generate_for_user(
     api_key: str,
     email: str,
@@ -308,182 +671,472 @@ def _generate_for_user(
     avoid_conglomerates: bool,
     near_me: bool,
     radius_m: int | None = None,
+    progress_cb=None,
 ) -> List[Dict[str, Any]]:
-    sb = get_client()
+    sb = _sb()
 
-    # Fetch already-seen place_ids for this user
-    try:
-        already_rows = (
-            sb.table("history").select("park_place_id").ilike("email", email).execute().data or []
-        )
-        already = {row.get("park_place_id") for row in already_rows if row.get("park_place_id")}
-    except Exception:
-        already = set()
+    # place_ids known to be in this user's history: the session copy, plus
+    # per-page lookups below when that copy may be incomplete
+    history, history_complete = _history_pids(email)
+    already: set[str] = set(history)
 
     seen: set[str] = set()
+    seen_cells: set[tuple[int, int, str]] = set()  # (~50 m cell, name) of candidates in play
+    cell_of: Dict[str, tuple[int, int, str]] = {}  # pid -> its seen_cells entry
     found: List[Dict[str, Any]] = []
+    persist = not str(email).startswith("guest:")
 
     def emit(msg: str):
-        st.session_state.setdefault("log", [])
-        st.session_state["log"].append(msg)
+        if progress_cb:
+            progress_cb(msg)
 
     latlng = None
     if near_me:
-        latlng = c.get_approx_location_via_ip()
+        latlng = _ip_latlng()
         if not latlng:
             emit("[warn] Could not auto-detect location from IP; using manual location.")
             near_me = False
+        else:
+            # ~1 km grid: IP-location jitter between clicks still lands on the same
+            # Text Search cache entries (an offset this small is noise at 25 km+).
+            latlng = (round(latlng[0], 2), round(latlng[1], 2))
+
+    # Places already evaluated for this user around the same geohash cell in the
+    # last day: skip them up front instead of paying for their details again.
+    recent = _recent_pids(email, _geohash7(*latlng), bool(avoid_conglomerates)) if (near_me and latlng) else None
+    if recent:
+        already |= recent
+    # ...and anything already evaluated by an earlier "Find" click this session.
+    session_seen: set[str] = st.session_state.setdefault("_seen_pids", {}).setdefault(email, set())
+    already |= session_seen
+    evaluated: set[str] = set()
+    # Set once enough parks are found; queued site checks then return without any HTTP
+    stop_evt = threading.Event()
+
+    def load_details(pids: list[str]) -> Dict[str, Dict[str, Any]]:
+        """Stage 1: in-process hits inline, shared-cache hits in one query, then Google for the rest in parallel."""
+        dets: Dict[str, Dict[str, Any]] = {}
+        for pid in pids:
+            det = _memo_get_details(pid)
+            if det is not None:
+                dets[pid] = det
+        misses = [pid for pid in pids if pid not in dets]
+        if misses and get_cached_details:
+            try:
+                shared = get_cached_details(sb, misses)
+            except Exception:
+                shared = {}
+            for pid, det in shared.items():
+                if det:
+                    dets[pid] = det
+                    _memo_details(pid, det)
+            misses = [pid for pid in misses if pid not in dets]
+        if misses:
+            futs = {_pool("details").submit(_coalesced, "details", pid, _cached_place_details, api_key, pid, persist): pid
+                    for pid in misses}
+            for fut in as_completed(futs):
+                try:
+                    dets[futs[fut]] = fut.result()
+                    _memo_details(futs[fut], dets[futs[fut]])
+                except Exception as e:
+                    emit(f"[warn] skipped place {futs[fut]}: {e}")
+        return dets
+
+    def screen(pid: str, r_name_fallback: str, r_types: list[str] | None,
+               det: Dict[str, Any]) -> Dict[str, Any] | None:
+        """Cheap in-process filters on Place Details; no network. Only verdicts that hold whatever the user's settings are."""
+        name = det.get("name", r_name_fallback)
+        types = det.get("types", r_types) or r_types or []
+        # The Text Search name/types already passed; only re-check when Details disagrees
+        if (name != r_name_fallback or set(types) != set(r_types or [])) and not _looks_like_rv_or_mhp(name, types):
+            return None
 
-    OTA_HOST_SNIPPETS = (
-        "booking.com", "expedia", "hotels.com", "koa.com", "goodsam.com",
-        "campendium", "reserveamerica", "hipcamp", "rvshare", "roverpass",
-        "recreation.gov", "usace.army.mil",
-    )
+        website = c._sanitize_url(det.get("website", ""))
+        phone = det.get("formatted_phone_number", "") or det.get("international_phone_number", "")
+        addr = det.get("formatted_address", "")
+        comps = c.extract_address_components(det)
 
-    def eval_place(pid: str, r_name_fallback: str, r_types: list[str] | None) -> Dict[str, Any] | None:
-        try:
-            det = _cached_place_details(api_key, pid)
-            name = det.get("name", r_name_fallback)
-            types = det.get("types", r_types) or r_types or []
-            if not _looks_like_rv_or_mhp(name, types):
-                return None
-
-            website = c._sanitize_url(det.get("website", ""))
-            phone = det.get("formatted_phone_number", "") or det.get("international_phone_number", "")
-            addr = det.get("formatted_address", "")
-            comps = {"city": "", "state": "", "zip": ""}
-            for comp in det.get("address_components", []) or []:
-                types_ac = comp.get("types", [])
-                if "locality" in types_ac:
-                    comps["city"] = comp.get("long_name", "")
-                if "administrative_area_level_1" in types_ac:
-                    comps["state"] = comp.get("short_name", "")
-                if "postal_code" in types_ac:
-                    comps["zip"] = comp.get("long_name", "")
-
-            if not website and not phone:
-                return None
-            if website and any(sn in website.lower() for sn in OTA_HOST_SNIPPETS):
-                return None
-            if avoid_conglomerates and c._is_conglomerate(name, website):
-                return None
+        if not website and not phone:
+            return None
+        if website and _OTA_RE.search(website):
+            return None
 
+        return {
+            "park_place_id": pid,
+            "park_name": name,
+            "website": website,
+            "phone": phone,
+            "address": addr,
+            "city": comps["city"],
+            "state": comps["state"],
+            "zip": comps["zip"],
+            "pad_count": "",
+            "source": "Google Places",
+        }
+
+    # site key -> fresh probe result, flushed to the shared site-check cache per page
+    probed: Dict[str, tuple] = {}
+
+    def site_verdict(row: Dict[str, Any], result: tuple) -> Dict[str, Any] | None:
+        no_booking, booking_hit, pad_count = result
+        if not (no_booking and (pad_count is None or pad_count >= c.PAD_MIN)):
+            return None
+        row["pad_count"] = pad_count or ""
+        return row
+
+    def check_site(row: Dict[str, Any]) -> Dict[str, Any] | None:
+        """Stage 2: booking/pad-count probe of the park website (the slow HTTP part)."""
+        if stop_evt.is_set():
+            return None
+        website = row["website"]
+
+        def probe():
             try:
-                no_booking, booking_hit, pad_count = c.check_booking_and_pads(website, timeout_sec=PAD_HTTP_TIMEOUT)
+                return c.check_booking_and_pads(
+                    website, timeout_sec=PAD_HTTP_TIMEOUT, http_session=_http()
+                )
             except TypeError:
-                no_booking, booking_hit, pad_count = c.check_booking_and_pads(website)
-
-            if not (no_booking and (pad_count is None or pad_count >= c.PAD_MIN)):
-                return None
-
-            return {
-                "park_place_id": pid,
-                "park_name": name,
-                "website": website,
-                "phone": phone,
-                "address": addr,
-                "city": comps["city"],
-                "state": comps["state"],
-                "zip": comps["zip"],
-                "pad_count": pad_count or "",
-                "source": "Google Places",
-            }
-        except Exception as e:
-            emit(f"[warn] skipped place {pid}: {e}")
-            return None
+                return c.check_booking_and_pads(website, http_session=_http())
+
+        result = _coalesced("site", _site_key(website) or website, probe)
+        probed[_site_key(website)] = result
+        return site_verdict(row, result)
+
+    async def check_sites_async(rows: list[Dict[str, Any]], need: int) -> list[tuple]:
+        """Stage 2 on one event loop: every probe shares a connection pool, bounded by SITE_CONCURRENCY."""
+        sem = asyncio.Semaphore(SITE_CONCURRENCY)
+        connector = aiohttp.TCPConnector(limit=SITE_CONCURRENCY, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(connector=connector, headers={"User-Agent": "Mozilla/5.0"}) as http:
+            async def probe(row):
+                async with sem:
+                    try:
+                        result = await c.check_booking_and_pads_async(http, row["website"])
+                    except Exception as e:
+                        return row, e
+                    probed[_site_key(row["website"])] = result
+                    return row, site_verdict(row, result)
+
+            tasks = [asyncio.create_task(probe(row)) for row in rows]
+            out, hits = [], 0
+            try:
+                for fut in asyncio.as_completed(tasks):
+                    row, verdict = await fut
+                    out.append((row, verdict))
+                    if verdict and not isinstance(verdict, Exception):
+                        hits += 1
+                        if hits >= need:
+                            break
+            finally:
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        return out
+
+    def check_sites(rows: list[Dict[str, Any]], need: int):
+        """Yield (row, qualified row | None | exception): shared-cache hits first, then probes as they finish."""
+        if not rows:
+            return
+        cached: Dict[str, tuple] = {}
+        if get_cached_site_checks:
+            try:
+                cached = get_cached_site_checks(sb, [_site_key(row["website"]) for row in rows])
+            except Exception:
+                pass
+        todo = []
+        for row in rows:
+            hit = cached.get(_site_key(row["website"]))
+            if hit is None:
+                todo.append(row)
+                continue
+            verdict = site_verdict(row, hit)
+            need -= bool(verdict)
+            yield row, verdict
+        if not todo:
+            return
+        try:
+            if aiohttp is not None and hasattr(c, "check_booking_and_pads_async"):
+                yield from asyncio.run(check_sites_async(todo, need))
+                return
+            futs = {_pool("sites").submit(check_site, row): row for row in todo}
+            try:
+                for fut in as_completed(futs):
+                    try:
+                        yield futs[fut], fut.result()
+                    except Exception as e:
+                        yield futs[fut], e
+            finally:
+                for fut in futs:
+                    fut.cancel()
+        finally:
+            if persist and put_cached_site_checks and probed:
+                try:
+                    put_cached_site_checks(sb, dict(probed))
+                except Exception:
+                    pass
+                probed.clear()
+
+    restarted: set[tuple[str, int]] = set()  # (query, radius) already re-fetched live once
+
+    def fetch_page(query: str, radius: int, token: str | None) -> dict:
+        kwargs = dict(
+            _api_key=api_key,
+            query=query,
+            location_bias=None if near_me else location,
+            pagetoken=token,
+            latlng=latlng if near_me else None,
+            radius_m=radius,
+            persist=persist,
+        )
+        if not token:
+            return _cached_text_search(**kwargs)
+
+        def restart() -> dict:
+            # The token came from a first page cached past its lifetime: fetch page 1
+            # live instead and follow its fresh token (the caller skips seen places).
+            if (query, radius) in restarted:
+                raise SystemExit(f"Google Text Search error: page token rejected for {query!r}")
+            restarted.add((query, radius))
+            return _text_search_live(api_key, query, kwargs["location_bias"], None,
+                                     kwargs["latlng"], radius)
+
+        if PLACES_V1:
+            try:
+                return _cached_text_search(**kwargs)
+            except Exception:
+                return restart()
+        # A legacy next_page_token needs ~2 s before Google accepts it. This runs on the
+        # shared page pool, so the wait overlaps evaluation of the previous page.
+        time.sleep(PAGE_SLEEP_SECS)
+        for attempt in range(2):
+            try:
+                return _cached_text_search(**kwargs)
+            except SystemExit as e:
+                if "INVALID_REQUEST" not in str(e):
+                    raise
+                if attempt == 0:
+                    time.sleep(1.0)  # token may still not be ready; retry once
+        return restart()
 
     # Plan: one radius for manual location; expanding radii for near-me
     radii_plan = (NEARME_RADII if near_me else [int(radius_m or DEFAULT_NEAR_ME_RADIUS_M)])
+    if PLACES_V1:
+        # searchText caps the bias circle at 50 km; wider steps would resend the same billed request
+        radii_plan = list(dict.fromkeys(min(int(r), c.PLACES_V1_MAX_RADIUS_M) for r in radii_plan))
 
-    for radius in radii_plan:
-        if len(found) >= requested:
-            break
+    # First pages of the current and the next radius are requested up front and
+    # concurrently, so widening the sweep doesn't wait on a fresh Places round trip.
+    queries = list(c.TARGET_QUERIES)[:TARGET_QUERY_LIMIT]
+    first_pages: dict[tuple[int, str], Any] = {}
 
-        pretty_km = round(radius / 1000)
-        where = f"your current area (+{pretty_km} km)" if near_me else location
-        emit(f"[info] Radius sweep: {pretty_km} km — searching near {where}")
+    def prefetch(radius: int):
+        for query in queries:
+            if (radius, query) not in first_pages:
+                first_pages[(radius, query)] = _pool("pages").submit(fetch_page, query, radius, None)
 
-        for idx, query in enumerate(c.TARGET_QUERIES):
-            if idx >= TARGET_QUERY_LIMIT or len(found) >= requested:
-                break
-
-            token = None
-            while True:
-                if len(found) >= requested:
-                    break
+    try:
+        for i, radius in enumerate(radii_plan):
+            prefetch(radius)
+            if i + 1 < len(radii_plan):
+                prefetch(radii_plan[i + 1])
+            pretty_km = round(radius / 1000)
+            where = f"your current area (+{pretty_km} km)" if near_me else location
+            emit(f"[info] Radius sweep: {pretty_km} km — searching near {where}")
+
+            # Queries are taken in the order their first page lands, so a slow
+            # query never holds up candidates another one already returned.
+            by_future = {first_pages[(radius, q)]: q for q in queries}
+            for first in as_completed(by_future):
+                query = by_future[first]
+                next_page = first_pages.pop((radius, query))
                 try:
-                    data = _cached_text_search(
-                        api_key=api_key,
-                        query=query,
-                        location_bias=None if near_me else location,
-                        pagetoken=token,
-                        latlng=latlng if near_me else None,
-                        radius_m=radius,
-                    )
-                except Exception as e:
-                    emit(f"[error] google_text_search failed: {e}")
-                    break
-
-                results = data.get("results", []) or []
-                token = data.get("next_page_token")
-
-                candidates: list[tuple[str, str, list[str] | None]] = []
-                for r in results:
-                    if len(found) >= requested:
-                        break
-                    pid = r.get("place_id")
-                    if not pid or pid in seen or pid in already:
-                        continue
-                    r_types = r.get("types", []) or []
-                    r_name = r.get("name", "")
-                    if not _looks_like_rv_or_mhp(r_name, r_types):
-                        continue
-                    seen.add(pid)
-                    candidates.append((pid, r_name, r_types))
-
-                if candidates:
-                    emit(f"[info] Checking {len(candidates)} candidates (parallel)… found so far: {len(found)}/{requested}")
-                    with ThreadPoolExecutor(max_workers=WORKERS) as ex:
-                        futs = [ex.submit(eval_place, pid, nm, tps) for (pid, nm, tps) in candidates]
-                        for fut in as_completed(futs):
-                            row = None
+                    while next_page is not None:
+                        try:
+                            data = next_page.result()
+                        except (Exception, SystemExit) as e:  # core raises SystemExit on API errors
+                            emit(f"[error] google_text_search failed: {e}")
+                            break
+
+                        results = data.get("results", []) or []
+                        token = data.get("next_page_token")
+                        # Start warming up the next page while this one is evaluated
+                        next_page = _pool("pages").submit(fetch_page, query, radius, token) if token else None
+
+                        # Only this page's unseen ids go to the history check, not the whole history
+                        fresh = [r["place_id"] for r in results
+                                 if r.get("place_id") and r["place_id"] not in seen and r["place_id"] not in already]
+                        if fresh and not history_complete:
                             try:
-                                row = fut.result()
+                                hits = history_pids_contains(sb, email, fresh)
+                                history |= hits
+                                already |= hits
                             except Exception as e:
-                                emit(f"[warn] worker error: {e}")
-                            if row:
-                                found.append(row)
+                                emit(f"[warn] history check failed: {e}")
+
+                        candidates: list[tuple[str, str, list[str] | None]] = []
+                        inline = {r["place_id"]: r["details"] for r in results if r.get("details")}
+                        for r in results:
+                            pid = r.get("place_id")
+                            if not pid or pid in seen or pid in already:
+                                continue
+                            # Closed parks are not leads; Text Search already says so, no Details needed
+                            if r.get("business_status") == "CLOSED_PERMANENTLY":
+                                seen.add(pid)
+                                continue
+                            r_types = r.get("types", []) or []
+                            r_name = r.get("name", "")
+                            if not _looks_like_rv_or_mhp(r_name, r_types):
+                                continue
+                            # Obvious chains are rejected on the Text Search name alone,
+                            # before paying for a Details call.
+                            if avoid_conglomerates and c._is_conglomerate(r_name, ""):
+                                seen.add(pid)
+                                continue
+                            # Same name at the same spot under a different place_id (duplicate
+                            # listing): one Details call is enough. The duplicate stays unseen,
+                            # so it can stand in if the queued listing is dropped below.
+                            cell = _near_cell(r)
+                            if cell is not None:
+                                if cell in seen_cells:
+                                    continue
+                                seen_cells.add(cell)
+                                cell_of[pid] = cell
+                            seen.add(pid)
+                            candidates.append((pid, r_name, r_types))
+
+                        if not candidates:
+                            continue
+                        emit(f"[info] Checking {len(candidates)} candidates (parallel)… found so far: {len(found)}/{requested}")
+                        dets = load_details([pid for pid, _, _ in candidates if pid not in inline])
+                        dets.update((pid, inline[pid]) for pid, _, _ in candidates if pid in inline)
+                        survivors: list[Dict[str, Any]] = []
+                        for pid, nm, tps in candidates:
+                            if pid not in dets:
+                                seen_cells.discard(cell_of.pop(pid, None))
+                                continue
+                            row = screen(pid, nm, tps, dets[pid])
+                            if row is None:
+                                evaluated.add(pid)
+                                seen_cells.discard(cell_of.pop(pid, None))
+                            elif avoid_conglomerates and c._is_conglomerate(row["park_name"], row["website"]):
+                                # Depends on the "avoid chains" toggle, so it isn't remembered as
+                                # evaluated: turning the toggle off must bring the park back.
+                                seen_cells.discard(cell_of.pop(pid, None))
+                            else:
+                                survivors.append(row)
+
+                        for row, verdict in check_sites(survivors, requested - len(found)):
+                            if isinstance(verdict, Exception):
+                                emit(f"[warn] skipped place {row['park_place_id']}: {verdict}")
+                                seen_cells.discard(cell_of.pop(row["park_place_id"], None))
+                                continue
+                            evaluated.add(row["park_place_id"])
+                            if verdict:
+                                found.append(verdict)
                                 if len(found) >= requested:
-                                    break
-
-                if not token or len(found) >= requested:
-                    break
-                time.sleep(PAGE_SLEEP_SECS)  # next_page_token warm-up
-
-        if len(found) < requested and near_me:
-            emit(f"[info] Radius {pretty_km} km complete; expanding…")
+                                    stop_evt.set()
+                                    raise _Done
+                finally:
+                    if next_page is not None:
+                        next_page.cancel()
+
+            if near_me:
+                emit(f"[info] Radius {pretty_km} km complete; expanding…")
+    except _Done:
+        pass
+    finally:
+        for fut in first_pages.values():
+            fut.cancel()
 
+    session_seen.update(evaluated)
+    if recent is not None:
+        recent.update(evaluated)
     emit(f"[info] Completed. Found {len(found)} new parks.")
     return found
 
 # =============================================================================
 # Responsive table helper
 # =============================================================================
+RESULT_COLS = [
+    "park_place_id", "park_name", "website", "phone", "address",
+    "city", "state", "zip", "pad_count", "source",
+]
+# Low-cardinality columns are categorical; pad_count is a nullable small int
+RESULT_DTYPES = {col: "string[pyarrow]" for col in RESULT_COLS}
+RESULT_DTYPES.update({"state": "category", "source": "category"})
+del RESULT_DTYPES["pad_count"]
+
+def _results_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Search rows -> DataFrame with a fixed column order and Arrow-backed strings."""
+    df = pd.DataFrame.from_records(rows, columns=RESULT_COLS).astype(RESULT_DTYPES)
+    df["pad_count"] = pd.to_numeric(df["pad_count"], errors="coerce").astype("Int32")
+    return df
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _results_csv(df_full: pd.DataFrame) -> bytes:
+    """CSV export of a results frame, serialized once per result set rather than on every rerun."""
+    return df_full.drop(columns=["park_place_id"]).to_csv(index=False).encode("utf-8")
+
+HISTORY_COLS = [
+    "created_at", "park_place_id", "park_name", "phone", "website", "address",
+    "city", "state", "zip", "source", "detected_keyword", "pad_count",
+]
+
+def _history_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """History rows -> DataFrame with the columns the history query selects, in order."""
+    return pd.DataFrame.from_records(rows, columns=HISTORY_COLS).astype(
+        {"state": "category", "source": "category", "detected_keyword": "category"}
+    )
+
+def _anchor_names(df: pd.DataFrame) -> pd.Series:
+    """park_name as an <a> tag wherever a website exists, built column-wise (no apply)."""
+    names = df["park_name"].fillna("").astype(str).str.replace('"', "&quot;", regex=False)
+    urls = df["website"].fillna("").astype(str).str.replace('"', "&quot;", regex=False)
+    has_url = urls.ne("")
+    out = names.copy()
+    out[has_url] = (
+        '<a href="' + urls[has_url] + '" target="_blank" rel="noopener noreferrer">'
+        + names[has_url] + "</a>"
+    )
+    return out
+
+# Responsive table CSS (desktop -> mobile cards). Streamlit drops elements that a
+# rerun doesn't emit, so it is sent every run; whitespace is collapsed once here
+# to keep that payload small.
+_RVP_CSS = re.sub(r"\s+", " ", """
+<style>
+.rvp-table { width:100%; border-collapse: collapse; table-layout: fixed; }
+.rvp-table th, .rvp-table td { padding: 8px 10px; border-bottom: 1px solid rgba(255,255,255,0.08); vertical-align: top; word-wrap: break-word; overflow-wrap: anywhere; }
+.rvp-table th { text-align: left; font-weight: 600; }
+.rvp-table td a { text-decoration: underline; }
+@media (max-width: 760px) {
+  .rvp-table thead { display: none; }
+  .rvp-table, .rvp-table tbody, .rvp-table tr, .rvp-table td { display: block; width: 100%; }
+  .rvp-table tr { margin: 0 0 12px 0; padding: 12px; border: 1px solid rgba(255,255,255,0.12); border-radius: 10px; }
+  .rvp-table td { border: none; padding: 4px 0; }
+  .rvp-table td::before {
+     content: attr(data-label);
+     display: block;
+     font-size: 12px; opacity: .7; margin-bottom: 2px;
+  }
+  .rvp-table td[data-label="Park"] { font-weight: 600; font-size: 16px; }
+  .rvp-table td[data-label="Park"]::before { display: none; }
+}
+</style>
+""").strip()
+
 def _render_responsive_table(df: pd.DataFrame, order: list[str], labels: dict[str, str]) -> None:
     df = df[[c for c in order if c in df.columns]].copy()
     thead = "".join(f"<th>{labels.get(c,c)}</th>" for c in df.columns)
-    rows_html = []
-    for _, row in df.iterrows():
-        tds = []
-        for c in df.columns:
-            val = "" if pd.isna(row[c]) else str(row[c])
-            # Do not escape so <a> renders
-            tds.append(f'<td data-label="{labels.get(c,c)}">{val}</td>')
-        rows_html.append(f"<tr>{''.join(tds)}</tr>")
+    # Built column-wise: one string concat per column instead of a Python loop per cell
+    rows_html = pd.Series("<tr>", index=df.index)
+    for c in df.columns:
+        col = df[c].astype(object)
+        vals = col.where(col.notna(), "").astype(str)  # not escaped, so <a> renders
+        rows_html = rows_html + f'<td data-label="{labels.get(c,c)}">' + vals + "</td>"
     html = f"""
     <table class="rvp-table">
       <thead><tr>{thead}</tr></thead>
-      <tbody>{''.join(rows_html)}</tbody>
+      <tbody>{''.join(rows_html + "</tr>")}</tbody>
     </table>
     """
     st.markdown(html, unsafe_allow_html=True)
@@ -495,46 +1148,30 @@ def main():
     st.markdown("<h1>🗺️ RV Prospector</h1>", unsafe_allow_html=True)
     st.caption("Find RV parks without online booking — Demo gives you 10 new leads per day.")
 
-    # ---- responsive table CSS (desktop -> mobile cards) ----
-    st.markdown("""
-    <style>
-    .rvp-table { width:100%; border-collapse: collapse; table-layout: fixed; }
-    .rvp-table th, .rvp-table td { padding: 8px 10px; border-bottom: 1px solid rgba(255,255,255,0.08); vertical-align: top; word-wrap: break-word; overflow-wrap: anywhere; }
-    .rvp-table th { text-align: left; font-weight: 600; }
-    .rvp-table td a { text-decoration: underline; }
-    @media (max-width: 760px) {
-      .rvp-table thead { display: none; }
-      .rvp-table, .rvp-table tbody, .rvp-table tr, .rvp-table td { display: block; width: 100%; }
-      .rvp-table tr { margin: 0 0 12px 0; padding: 12px; border: 1px solid rgba(255,255,255,0.12); border-radius: 10px; }
-      .rvp-table td { border: none; padding: 4px 0; }
-      .rvp-table td::before {
-         content: attr(data-label);
-         display: block;
-         font-size: 12px; opacity: .7; margin-bottom: 2px;
-      }
-      .rvp-table td[data-label="Park"] { font-weight: 600; font-size: 16px; }
-      .rvp-table td[data-label="Park"]::before { display: none; }
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(_RVP_CSS, unsafe_allow_html=True)
 
     cm = stx.CookieManager(key="rvp_cookies")
-    sb = get_client()
-    st.session_state.setdefault("log", [])
+    sb = _sb()
 
-    cookies = cm.get_all()
-    if cookies is None:
-        st.stop()
+    # Cookies are stable for the life of the tab: read them once, then reuse.
+    if "_cookies_cache" not in st.session_state:
+        ck = cm.get_all()
+        if ck is None:
+            st.stop()
+        st.session_state["_cookies_cache"] = dict(ck)
+    cookies = st.session_state["_cookies_cache"]
 
     # ---------- Identity init (cookie OR URL param) ----------
     if "user_key" not in st.session_state:
         saved_email = cookies.get("rvp_email") or _get_url_email()
         if saved_email:
             prior = bool(st.session_state.get("unlocked"))
-            try:
-                unlocked_db = bool(is_unlocked(sb, saved_email))
-            except Exception:
-                unlocked_db = False
+            unlocked_db = _read_tier_claim(cookies, saved_email)
+            if unlocked_db is None:
+                try:
+                    unlocked_db = _cached_is_unlocked(saved_email)
+                except Exception:
+                    unlocked_db = False
             _set_signed_in(cm, saved_email, prior or unlocked_db)
         else:
             st.session_state["user_key"] = _ensure_guest_cookie(cm, cookies)
@@ -552,8 +1189,9 @@ def main():
 
             if submitted and email and "@" in email:
                 try:
-                    upsert_profile(get_client(), email, full_name or None)
-                    unlocked_now = bool(is_unlocked(get_client(), email))
+                    profile = upsert_profile(_sb(), email, full_name or None)
+                    _cached_is_unlocked.clear()  # upsert may have just unlocked this email
+                    unlocked_now = bool(profile.get("unlocked", False))
                     _set_signed_in(cm, email, unlocked_now)
                     _set_url_email(email)
                     st.success(f"✅ Signed in as {email} ({'Unlimited' if unlocked_now else 'Demo user'})")
@@ -562,13 +1200,16 @@ def main():
                     st.warning(f"Login issue: {e}")
         else:
             user_email = str(st.session_state["user_key"])
-            session_unlocked = bool(st.session_state.get("unlocked"))
-            try:
-                db_unlocked = bool(is_unlocked(get_client(), user_email))
-            except Exception:
-                db_unlocked = False
-            current_unlocked = session_unlocked or db_unlocked
-            _set_signed_in(cm, user_email, current_unlocked)
+            # The flag only changes on activation (which updates it directly), so the
+            # session trusts it for UNLOCK_RECHECK_SECS instead of re-checking and
+            # rewriting cookies on every widget interaction.
+            if time.time() - st.session_state.get("_unlocked_checked_at", 0) > UNLOCK_RECHECK_SECS:
+                session_unlocked = bool(st.session_state.get("unlocked"))
+                try:
+                    db_unlocked = _cached_is_unlocked(user_email)
+                except Exception:
+                    db_unlocked = False
+                _set_signed_in(cm, user_email, session_unlocked or db_unlocked)
 
             st.write(
                 f"Signed in as **{user_email}** "
@@ -578,11 +1219,12 @@ def main():
             if not st.session_state.get("unlocked"):
                 if st.button("Activate Unlimited"):
                     try:
-                        upsert_profile(get_client(), user_email, None)
+                        upsert_profile(_sb(), user_email, None)
                         if grant_unlimited:
-                            grant_unlimited(get_client(), user_email, None)
+                            grant_unlimited(_sb(), user_email, None)
                         else:
-                            get_client().table("profiles").upsert({"email": user_email, "unlocked": True}).execute()
+                            _sb().table("profiles").upsert({"email": user_email, "unlocked": True}).execute()
+                        _cached_is_unlocked.clear()
                         _set_signed_in(cm, user_email, True)
                         _set_url_email(user_email)
                         st.success("Unlimited activated for your account.")
@@ -593,9 +1235,15 @@ def main():
             if st.button("Sign out"):
                 _sign_out(cm)
 
+    # A background save that has finished since the last rerun reports back here
+    _collect_pending_save(wait=False)
+
     # API key
-    api_key = c.load_api_key()
+    api_key = _api_key()
     if not api_key:
+        # Don't keep "no key" around: the next rerun re-reads secrets and .env
+        _api_key.clear()
+        _secrets_to_env.clear()
         st.error("Server misconfigured: missing API key.")
         st.stop()
 
@@ -611,40 +1259,47 @@ def main():
         else:
             st.session_state.setdefault("__hist_page", 1)  # 1-based
             page = st.session_state["__hist_page"]
-            offset = (page - 1) * PAGE_SIZE_HISTORY
+            # cursors[i] is the last row shown before page i+1 (None for page 1)
+            cursors = st.session_state.setdefault(f"__hist_cursors:{user_key}", [None])
+            if page > len(cursors):
+                page = st.session_state["__hist_page"] = 1
+            before = cursors[page - 1]
 
+            try:
+                total = _history_count(user_key)
+            except Exception:
+                total = None
+            # With an exact count the page is fetched as-is; otherwise probe one extra row
             rows_plus = []
             try:
-                rows_plus = list_history_rows(get_client(), user_key, limit=PAGE_SIZE_HISTORY + 1, offset=offset)
+                rows_plus = _history_page(user_key, before, PAGE_SIZE_HISTORY + (total is None))
             except Exception as e:
                 st.error(f"Could not load history: {e}")
 
             rows = rows_plus[:PAGE_SIZE_HISTORY]
-            has_next = len(rows_plus) > PAGE_SIZE_HISTORY
+            if total is None:
+                has_next = len(rows_plus) > PAGE_SIZE_HISTORY
+            else:
+                has_next = page * PAGE_SIZE_HISTORY < total
+            page_label = f"Page <strong>{page}</strong>" + (
+                f" of {max(1, -(-total // PAGE_SIZE_HISTORY))}" if total is not None else ""
+            )
 
             if not rows and page > 1:
                 st.info("No more results on this page. Try going back a page.")
             elif not rows:
                 st.caption("No history yet for this account.")
             else:
-                df_hist = pd.DataFrame(rows)
+                df_hist = _history_frame(rows)
 
                 # Clickable park names: real <a> tags
-                if {"park_name", "website"}.issubset(df_hist.columns):
-                    def _anchor(r):
-                        name = (r.get("park_name") or "").replace('"', "&quot;")
-                        url  = (r.get("website") or "").replace('"', "&quot;")
-                        return f'<a href="{url}" target="_blank" rel="noopener noreferrer">{name}</a>' if url else name
-                    df_hist["park_name"] = df_hist.apply(_anchor, axis=1)
+                df_hist["park_name"] = _anchor_names(df_hist)
 
                 order = ["created_at", "park_name", "phone", "address", "city", "state", "zip"]
                 labels = {"created_at":"Date","park_name":"Park","phone":"Phone","address":"Address","city":"City","state":"State","zip":"ZIP"}
 
-                if "created_at" in df_hist.columns:
-                    try:
-                        df_hist["created_at"] = pd.to_datetime(df_hist["created_at"]).dt.strftime("%Y-%m-%d %H:%M")
-                    except Exception:
-                        pass
+                # Supabase returns ISO-8601 text; "YYYY-MM-DDTHH:MM" is its first 16 chars
+                df_hist["created_at"] = df_hist["created_at"].fillna("").astype(str).str.slice(0, 16).str.replace("T", " ", regex=False)
 
                 _render_responsive_table(df_hist, order, labels)
 
@@ -654,27 +1309,36 @@ def main():
                 with middle:
                     c1, c2, c3 = st.columns([1, 2, 1])
                     prev_clicked = c1.button("‹", key="hist_prev", use_container_width=True, disabled=(page <= 1))
-                    c2.markdown(f"<div style='text-align:center;padding:6px 0'>Page <strong>{page}</strong></div>", unsafe_allow_html=True)
+                    c2.markdown(f"<div style='text-align:center;padding:6px 0'>{page_label}</div>", unsafe_allow_html=True)
                     next_clicked = c3.button("›", key="hist_next", use_container_width=True, disabled=(not has_next))
                 if prev_clicked and page > 1:
                     st.session_state["__hist_page"] = page - 1
                 if next_clicked and has_next:
+                    del cursors[page:]
+                    cursors.append((rows[-1]["created_at"], rows[-1]["park_place_id"]))
                     st.session_state["__hist_page"] = page + 1
 
-                # CSV export
-                try:
-                    all_rows = list_history_all(get_client(), user_key)
-                    df_all = pd.DataFrame(all_rows)
-                    csv = df_all.to_csv(index=False)
+                # CSV export: the full history is only pulled when asked for,
+                # then kept for the session instead of being rebuilt every rerun.
+                csv_key = f"__hist_csv:{user_key}"
+                if csv_key not in st.session_state:
+                    if st.button("Prepare My Entire History (CSV)", key="hist_prepare_csv", use_container_width=True):
+                        try:
+                            buf = io.BytesIO()
+                            _history_frame(list_history_all(_sb(), user_key)).to_csv(
+                                buf, index=False, chunksize=1024
+                            )
+                            st.session_state[csv_key] = buf.getvalue()
+                        except Exception as e:
+                            st.warning(f"CSV export unavailable: {e}")
+                if csv_key in st.session_state:
                     st.download_button(
                         "⬇️ Download My Entire History (CSV)",
-                        data=csv,
+                        data=st.session_state[csv_key],
                         file_name="rvprospector_history.csv",
                         mime="text/csv",
                         use_container_width=True,
                     )
-                except Exception as e:
-                    st.warning(f"CSV export unavailable: {e}")
 
     # =========================================================================
     # Controls
@@ -696,6 +1360,10 @@ def main():
         user_key = st.session_state["user_key"]
         unlocked = bool(st.session_state.get("unlocked"))
         requested = min(int(requested), SEARCH_HARD_CAP)
+        st.session_state.pop("_last_results", None)  # a new search replaces the shown results
+
+        # The demo limit must see the leads written by the previous search
+        _collect_pending_save(wait=True)
 
         allowed, is_unlim, remaining = (requested, True, -1) if unlocked else slice_by_trial(
             sb, user_key, int(requested)
@@ -706,7 +1374,10 @@ def main():
             st.stop()
 
         with st.status("Searching for parks...", expanded=True) as status:
-            st.session_state["log"] = []
+            def _progress(msg: str):
+                status.update(label=msg)
+                st.write(msg)
+
             rows = _generate_for_user(
                 api_key=api_key,
                 email=user_key,
@@ -715,40 +1386,55 @@ def main():
                 avoid_conglomerates=avoid_conglom,
                 near_me=use_near_me,
                 radius_m=DEFAULT_NEAR_ME_RADIUS_M if use_near_me else None,
+                progress_cb=_progress,
             )
-            record_history(sb, user_key, rows)
-            if not is_unlim and not str(user_key).startswith("guest:"):
-                increment_leads(sb, user_key, len(rows))
+            # Saving runs in the background so results render without waiting on Supabase
+            # The session's history set is only updated once the save has succeeded
+            st.session_state["_pending_save"] = (
+                _pool("writes").submit(
+                    _save_search, sb, user_key, list(rows),
+                    not is_unlim and not str(user_key).startswith("guest:"),
+                ),
+                user_key,
+                [r["park_place_id"] for r in rows],
+            )
+            st.session_state.pop(f"__hist_csv:{user_key}", None)  # prepared export is now stale
             status.update(label="✅ Done", state="complete")
 
         if not rows:
             st.info("No new parks found.")
             st.stop()
 
-        # ---------------------- Results (clickable names) ----------------------
-        df = pd.DataFrame(rows)
-        if {"website", "park_name"}.issubset(df.columns):
-            df["park_name"] = df.apply(
-                lambda x: f"[{x['park_name']}]({x['website']})" if x["website"] else x["park_name"],
-                axis=1,
-            )
-        show_cols = ["park_name", "phone", "address", "city", "state", "zip"]
-        show_cols = [c for c in show_cols if c in df.columns]
-        df = df[show_cols].copy()
+        # Built once per search and kept for the session: reruns (expanders, the
+        # download click) re-render these frames instead of rebuilding them.
+        df_full = _results_frame(rows)  # the table and the CSV are both views of it
+        show_cols = ["park_name", "website", "phone", "address", "city", "state", "zip"]
+        df = df_full[show_cols].copy()
         df.insert(0, "#", range(1, len(df) + 1))
+        st.session_state["_last_results"] = (df_full, df)
 
+    # ---------------------- Results (clickable names) ----------------------
+    last = st.session_state.get("_last_results")
+    if last is not None:
+        df_full, df = last
         st.subheader(f"Results ({len(df)})")
-        try:
-            st.markdown(df.to_markdown(index=False), unsafe_allow_html=True)
-        except Exception:
-            st.dataframe(df, use_container_width=True, hide_index=True)
-
-        buf = io.StringIO()
-        pd.DataFrame(rows).drop(columns=["park_place_id"], errors="ignore").to_csv(buf, index=False)
-        st.download_button("⬇️ Download CSV", buf.getvalue(), "rv_parks.csv", "text/csv")
+        st.dataframe(
+            df,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "#": st.column_config.NumberColumn(width="small"),
+                "park_name": st.column_config.TextColumn("Park"),
+                "website": st.column_config.LinkColumn("Website", display_text=r"https?://(?:www\.)?([^/]+)"),
+                "phone": "Phone",
+                "address": "Address",
+                "city": "City",
+                "state": "State",
+                "zip": "ZIP",
+            },
+        )
 
-        with st.expander("Run Log"):
-            st.code("\n".join(st.session_state.get("log", [])))
+        st.download_button("⬇️ Download CSV", _results_csv(df_full), "rv_parks.csv", "text/csv")
 
 if __name__ == "__main__":
     main()
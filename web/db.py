@@ -1,5 +1,6 @@
 from __future__ import annotations
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Set, Any
 from datetime import date
@@ -19,9 +20,12 @@ candidates = [
     HOME / ".rvprospector" / ".env"
 ]
 
+# First .env found is loaded for all its keys (GOOGLE_PLACES_API_KEY too); the
+# real environment, including secrets already copied into it, wins over it.
 for p in candidates:
     if p.exists():
-        load_dotenv(dotenv_path=p, override=True)
+        load_dotenv(dotenv_path=p, override=False)
+        break
 
 SUPABASE_URL = (os.getenv("SUPABASE_URL") or "").strip()
 SUPABASE_ANON_KEY = (os.getenv("SUPABASE_ANON_KEY") or "").strip()
@@ -49,9 +53,29 @@ except Exception:
 # -----------------------------
 # Supabase client
 # -----------------------------
+@lru_cache(maxsize=1)
 def get_client() -> SupabaseClient:
+    """One client per process, so its HTTP connection pool is reused across calls."""
     return create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
 
+def _user_key(email: str) -> str:
+    """History/profile key as stored: emails lowercased at write and read, so lookups are plain equality."""
+    return (email or "").strip().lower()
+
+# Tables/SQL functions this database turned out not to have. Recorded once per
+# process so later calls skip straight to their fallback.
+_MISSING: Set[str] = set()
+# PostgREST "not in schema cache" (function / table) and Postgres undefined function / table
+_MISSING_CODES = {"PGRST202", "PGRST205", "42883", "42P01"}
+
+def _mark_if_missing(name: str, exc: Exception) -> bool:
+    """True (and remembered) when `exc` says `name` isn't deployed; False for any other failure."""
+    code = str(getattr(exc, "code", "") or "")
+    if code in _MISSING_CODES or (not code and "404" in str(exc)):
+        _MISSING.add(name)
+        return True
+    return False
+
 # -----------------------------
 # Profiles
 # -----------------------------
@@ -60,24 +84,29 @@ def upsert_profile(sb: SupabaseClient, email: str, full_name: str | None = None)
     if not email:
         raise ValueError("Email required")
 
-    res = sb.table(PROFILES).select("*").eq("email", email).execute()
-    row = (
-        res.data[0]
-        if res.data
-        else {
-            "email": email,
-            "full_name": full_name or "",
-            "unlocked": False,
-            "leads_used": 0,
-        }
-    )
-
-    # Auto-unlock unlimited users
-    if email in UNLIMITED_EMAILS and not row.get("unlocked", False):
-        row["unlocked"] = True
-
-    sb.table(PROFILES).upsert(row, on_conflict="email").execute()
-    return row
+    # New users: one insert carrying explicit values, so nothing depends on column
+    # defaults. ON CONFLICT DO NOTHING returns no row when the profile exists.
+    new_row = {
+        "email": email,
+        "full_name": full_name or "",
+        "unlocked": email in UNLIMITED_EMAILS,  # Auto-unlock unlimited users
+        "leads_used": 0,
+    }
+    res = sb.table(PROFILES).upsert(new_row, on_conflict="email", ignore_duplicates=True).execute()
+    if res.data:
+        return res.data[0]
+
+    # Existing users: touch only what sign-in sets; unlocked/leads_used are kept
+    changes: Dict[str, Any] = {}
+    if full_name:
+        changes["full_name"] = full_name
+    if email in UNLIMITED_EMAILS:
+        changes["unlocked"] = True
+    if changes:
+        res = sb.table(PROFILES).update(changes).eq("email", email).execute()
+    else:
+        res = sb.table(PROFILES).select("*").eq("email", email).execute()
+    return res.data[0] if res.data else new_row
 
 
 def is_unlocked(sb: SupabaseClient, email: str) -> bool:
@@ -92,24 +121,48 @@ def is_unlocked(sb: SupabaseClient, email: str) -> bool:
 # -----------------------------
 def get_leads_used_today(sb: SupabaseClient, email: str) -> int:
     """Counts how many parks this user has generated today (UTC)."""
+    email = _user_key(email)
     today = date.today().isoformat()
+    # count="exact" returns the total in the Content-Range header; limit(1) keeps the body to one row
     res = (
         sb.table(HISTORY)
-        .select("id")
+        .select("id", count="exact")
         .eq("email", email)
         .gte("created_at", f"{today}T00:00:00Z")
+        .limit(1)
         .execute()
     )
-    return len(res.data or [])
+    count = getattr(res, "count", None)
+    return int(count) if count is not None else len(res.data or [])
+
+# SQL function in web/schema.sql (profiles join + today's history count in one query):
+#   profile_status(p_email text) returns table(unlocked bool, used_today int)
+def profile_status(sb: SupabaseClient, email: str) -> tuple[bool, int]:
+    """
+    (unlocked, used_today) in a single RPC round-trip. Falls back to
+    is_unlocked + get_leads_used_today when the function isn't deployed.
+    """
+    email = _user_key(email)
+    if email in UNLIMITED_EMAILS:
+        return (True, 0)
+    if "profile_status" not in _MISSING:
+        try:
+            res = sb.rpc("profile_status", {"p_email": email}).execute()
+            row = res.data[0] if isinstance(res.data, list) and res.data else (res.data or {})
+            return (bool(row.get("unlocked", False)), int(row.get("used_today") or 0))
+        except Exception as e:
+            # Read-only, so a transient failure may fall back too; only a missing function is remembered
+            _mark_if_missing("profile_status", e)
+    unlocked = is_unlocked(sb, email)
+    return (unlocked, 0 if unlocked else get_leads_used_today(sb, email))
 
 def slice_by_trial(sb: SupabaseClient, email: str, requested: int) -> tuple[int, bool, int]:
     """
     Returns (allowed_today, is_unlocked, remaining_today)
     """
-    unlocked = is_unlocked(sb, email)
+    unlocked, used_today = profile_status(sb, email)
     if unlocked:
         return (requested, True, -1)
-    used_today = get_leads_used_today(sb, email)
     remaining = max(0, DEMO_LIMIT - used_today)
     allowed = min(requested, remaining)
     return (allowed, False, remaining)
@@ -127,13 +180,27 @@ def get_leads_used(sb: SupabaseClient, email: str) -> int:
     return int(res.data[0]["leads_used"]) if res.data else 0
 
 
+# SQL function in web/schema.sql (atomic: update profiles set leads_used = leads_used + p_n where email = p_email):
+#   increment_leads(p_email text, p_n int) returns void
 def increment_leads(sb: SupabaseClient, email: str, n: int) -> None:
     """
     Increment the legacy profiles.leads_used counter so existing
-    app code that calls this will keep working.
+    app code that calls this will keep working. Uses the atomic RPC when
+    deployed; only a database without the function falls back to
+    read-modify-write.
     """
     if n <= 0:
         return
+    email = _user_key(email)
+    if "increment_leads" not in _MISSING:
+        try:
+            sb.rpc("increment_leads", {"p_email": email, "p_n": int(n)}).execute()
+            return
+        except Exception as e:
+            # Any other error may have come after the UPDATE committed; retrying
+            # through the fallback could count the same leads twice.
+            if not _mark_if_missing("increment_leads", e):
+                raise
     used = get_leads_used(sb, email)
     sb.table(PROFILES).update({"leads_used": used + n}).eq("email", email).execute()
 
@@ -158,13 +225,14 @@ def count_leads_today(sb: SupabaseClient, user_key: str) -> int:
     resp = (
         sb.table(HISTORY)
         .select("id", count="exact")
-        .eq("email", user_key)
+        .eq("email", _user_key(user_key))
         .gte("created_at", start_iso)
         .lt("created_at", end_iso)
+        .limit(1)
         .execute()
     )
-    # postgrest-python returns count in resp.count or in resp.data length; prefer resp.count when available
-    return int(getattr(resp, "count", None) or len(resp.data or []))
+    count = getattr(resp, "count", None)
+    return int(count) if count is not None else len(resp.data or [])
 
 def slice_by_demo_today(sb: SupabaseClient, user_key: str, requested: int) -> tuple[int, int]:
     """
@@ -176,7 +244,21 @@ def slice_by_demo_today(sb: SupabaseClient, user_key: str, requested: int) -> tu
     return allowed, remaining
 
 def fetch_history_place_ids(sb: SupabaseClient, email: str) -> Set[str]:
-    res = sb.table(HISTORY).select("park_place_id").eq("email", email).execute()
+    res = sb.table(HISTORY).select("park_place_id").eq("email", _user_key(email)).execute()
+    return {row["park_place_id"] for row in (res.data or []) if row.get("park_place_id")}
+
+def history_pids_contains(sb: SupabaseClient, email: str, pids: List[str]) -> Set[str]:
+    """Subset of `pids` already in this user's history (one IN query per call)."""
+    pids = [p for p in dict.fromkeys(pids) if p]
+    if not pids:
+        return set()
+    res = (
+        sb.table(HISTORY)
+        .select("park_place_id")
+        .eq("email", _user_key(email))
+        .in_("park_place_id", pids)
+        .execute()
+    )
     return {row["park_place_id"] for row in (res.data or []) if row.get("park_place_id")}
 
 def record_signup(sb: SupabaseClient, email: str, full_name: str | None = None) -> None:
@@ -191,12 +273,24 @@ def record_signup(sb: SupabaseClient, email: str, full_name: str | None = None)
 
 
 def record_history(sb: SupabaseClient, email: str, rows: List[Dict[str, Any]]):
-    if not rows:
+    """
+    Writes all rows in a single batched upsert (one round-trip per search),
+    never one request per park.
+    """
+    payload = _history_payload(email, rows or [])
+    if not payload:
         return
-    payload = [
+    sb.table(HISTORY).upsert(payload, on_conflict="email,park_place_id").execute()
+
+def _history_payload(email: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # One row per place_id (last wins): a repeated key in a single upsert makes
+    # Postgres reject the whole statement ("cannot affect row a second time").
+    by_pid = {r["park_place_id"]: r for r in rows if r.get("park_place_id")}
+    email = _user_key(email)
+    return [
         {
             "email": email,
-            "park_place_id": r.get("park_place_id", ""),
+            "park_place_id": pid,
             "park_name": r.get("park_name", ""),
             "phone": r.get("phone", ""),
             "website": r.get("website", ""),
@@ -208,6 +302,127 @@ def record_history(sb: SupabaseClient, email: str, rows: List[Dict[str, Any]]):
             "detected_keyword": r.get("detected_keyword", ""),
             "pad_count": str(r.get("pad_count", "")),
         }
-        for r in rows
+        for pid, r in by_pid.items()
     ]
-    sb.table(HISTORY).upsert(payload, on_conflict="email,park_place_id").execute()
+
+# SQL function in web/schema.sql (one transaction: history upsert + leads_used bump):
+#   record_history_and_increment(p_email text, p_rows jsonb, p_n int) returns void
+def record_history_and_increment(sb: SupabaseClient, email: str, rows: List[Dict[str, Any]], n: int) -> None:
+    """
+    record_history + increment_leads in a single RPC round-trip. Falls back to
+    the two separate calls only when the function isn't deployed.
+    """
+    if not rows:
+        return
+    email = _user_key(email)
+    if "record_history_and_increment" not in _MISSING:
+        try:
+            sb.rpc("record_history_and_increment",
+                   {"p_email": email, "p_rows": _history_payload(email, rows), "p_n": int(n)}).execute()
+            return
+        except Exception as e:
+            # Only a missing function is safe to redo as two calls; any other
+            # failure may have committed and would double-count.
+            if not _mark_if_missing("record_history_and_increment", e):
+                raise
+    record_history(sb, email, rows)
+    increment_leads(sb, email, n)
+
+# -----------------------------
+# Google Places response cache
+# -----------------------------
+# Shared across users and app restarts. Tables are created by web/schema.sql;
+# without them every helper here answers "no hit" / does nothing.
+PLACE_DETAILS_CACHE = "place_details_cache"
+TEXT_SEARCH_CACHE = "text_search_cache"
+SITE_CHECKS = "site_checks"
+PLACE_DETAILS_MAX_AGE = timedelta(days=30)  # Google's caching window for place data
+TEXT_SEARCH_MAX_AGE = timedelta(hours=24)
+SITE_CHECK_MAX_AGE = timedelta(days=7)  # park sites change booking engines rarely
+
+def _fresh_since(max_age: timedelta) -> str:
+    return (datetime.now(timezone.utc) - max_age).isoformat()
+
+def _cache_call(table: str, run, default=None):
+    """Run one cache-table request; a missing table is remembered and answers `default` from then on."""
+    if table in _MISSING:
+        return default
+    try:
+        return run()
+    except Exception as e:
+        if _mark_if_missing(table, e):
+            return default
+        raise
+
+def get_cached_details(sb: SupabaseClient, pids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Bulk-fetch fresh Place Details payloads, keyed by place_id."""
+    pids = [p for p in dict.fromkeys(pids) if p]
+    if not pids:
+        return {}
+    res = _cache_call(PLACE_DETAILS_CACHE, lambda: (
+        sb.table(PLACE_DETAILS_CACHE)
+        .select("place_id, payload")
+        .in_("place_id", pids)
+        .gte("fetched_at", _fresh_since(PLACE_DETAILS_MAX_AGE))
+        .execute()
+    ))
+    if res is None:
+        return {}
+    return {row["place_id"]: row["payload"] for row in (res.data or []) if row.get("payload")}
+
+def put_cached_details(sb: SupabaseClient, pid: str, payload: Dict[str, Any]) -> None:
+    if not pid or not payload:
+        return
+    _cache_call(PLACE_DETAILS_CACHE, lambda: sb.table(PLACE_DETAILS_CACHE).upsert(
+        {"place_id": pid, "payload": payload, "fetched_at": datetime.now(timezone.utc).isoformat()},
+        on_conflict="place_id",
+    ).execute())
+
+def get_cached_text_search(sb: SupabaseClient, cache_key: str) -> Dict[str, Any] | None:
+    res = _cache_call(TEXT_SEARCH_CACHE, lambda: (
+        sb.table(TEXT_SEARCH_CACHE)
+        .select("payload")
+        .eq("cache_key", cache_key)
+        .gte("fetched_at", _fresh_since(TEXT_SEARCH_MAX_AGE))
+        .limit(1)
+        .execute()
+    ))
+    return res.data[0]["payload"] if res is not None and res.data else None
+
+def put_cached_text_search(sb: SupabaseClient, cache_key: str, payload: Dict[str, Any]) -> None:
+    if not cache_key or not payload:
+        return
+    _cache_call(TEXT_SEARCH_CACHE, lambda: sb.table(TEXT_SEARCH_CACHE).upsert(
+        {"cache_key": cache_key, "payload": payload, "fetched_at": datetime.now(timezone.utc).isoformat()},
+        on_conflict="cache_key",
+    ).execute())
+
+def get_cached_site_checks(sb: SupabaseClient, sites: List[str]) -> Dict[str, tuple]:
+    """Bulk-fetch fresh website probe results as (no_booking, booking_hit, pad_count), keyed by site."""
+    sites = [s for s in dict.fromkeys(sites) if s]
+    if not sites:
+        return {}
+    res = _cache_call(SITE_CHECKS, lambda: (
+        sb.table(SITE_CHECKS)
+        .select("site, no_booking, booking_hit, pad_count")
+        .in_("site", sites)
+        .gte("checked_at", _fresh_since(SITE_CHECK_MAX_AGE))
+        .execute()
+    ))
+    if res is None:
+        return {}
+    return {
+        row["site"]: (bool(row.get("no_booking")), row.get("booking_hit") or "", row.get("pad_count"))
+        for row in (res.data or [])
+    }
+
+def put_cached_site_checks(sb: SupabaseClient, results: Dict[str, tuple]) -> None:
+    """Upsert probe results keyed by site in a single request."""
+    now = datetime.now(timezone.utc).isoformat()
+    payload = [
+        {"site": site, "no_booking": bool(no_booking), "booking_hit": booking_hit or "",
+         "pad_count": pad_count, "checked_at": now}
+        for site, (no_booking, booking_hit, pad_count) in results.items() if site
+    ]
+    if payload:
+        _cache_call(SITE_CHECKS, lambda: sb.table(SITE_CHECKS).upsert(payload, on_conflict="site").execute())
@@ -2,7 +2,18 @@
 from __future__ import annotations
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# Kept-alive connections to Mailchimp. POST is retried on throttling/5xx only:
+# re-subscribing an existing member is rejected as "Member Exists", not duplicated.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=frozenset({"POST"}), raise_on_status=False),
+))
 
 def subscribe_mailchimp(email: str, phone: str = "") -> bool:
     """
@@ -27,7 +38,7 @@ def subscribe_mailchimp(email: str, phone: str = "") -> bool:
         "merge_fields": {"PHONE": phone},
     }
     try:
-        resp = requests.post(url, auth=("anystring", api_key), json=data, timeout=10)
+        resp = _SESSION.post(url, auth=("anystring", api_key), json=data, timeout=10)
         return resp.status_code in (200, 201)
     except Exception:
         return False
@@ -0,0 +1,17 @@
+-- 001: lowercase history.email (one-off, for deployments created before
+-- history lookups switched from ILIKE to equality on the lowercased email).
+--
+-- DESTRUCTIVE: where the same user has the same park under several email
+-- spellings (e.g. "Bob@x.com" and "bob@x.com"), only one row is kept: the
+-- lowercase one if present, otherwise the oldest. Back up `history` first.
+-- Run once, inside a transaction, e.g.:
+--   psql "$DATABASE_URL" -1 -f web/migrations/001_lowercase_history_email.sql
+
+delete from history a
+ using history b
+ where a.email <> lower(a.email)
+   and lower(b.email) = lower(a.email)
+   and b.park_place_id = a.park_place_id
+   and (b.email = lower(b.email) or b.id < a.id);
+
+update history set email = lower(email) where email <> lower(email);
@@ -0,0 +1,116 @@
+-- RV Prospector (web) — Supabase/Postgres schema.
+-- Idempotent: run it in the Supabase SQL editor (or `psql -f web/schema.sql`)
+-- on a new project, or again after upgrading to pick up new tables/functions.
+-- web/db.py still works without the optional parts (caches, RPCs): it notices
+-- the missing table/function once per process and uses its fallback.
+-- Only create-if-not-exists / create-or-replace here; anything that rewrites
+-- existing rows lives in web/migrations/ and is run deliberately, once.
+
+-- -----------------------------
+-- Core tables
+-- -----------------------------
+create table if not exists profiles (
+    email       text primary key,
+    full_name   text        not null default '',
+    unlocked    boolean     not null default false,
+    leads_used  integer     not null default 0,
+    created_at  timestamptz not null default now()
+);
+
+create table if not exists signups (
+    email       text primary key,
+    full_name   text        not null default '',
+    created_at  timestamptz not null default now()
+);
+
+-- email holds the user key: a lowercased email, or guest:{uuid}
+create table if not exists history (
+    id                bigint generated always as identity primary key,
+    email             text        not null,
+    park_place_id     text        not null,
+    park_name         text        not null default '',
+    phone             text        not null default '',
+    website           text        not null default '',
+    address           text        not null default '',
+    city              text        not null default '',
+    state             text        not null default '',
+    zip               text        not null default '',
+    source            text        not null default 'Google Places',
+    detected_keyword  text        not null default '',
+    pad_count         text        not null default '',
+    created_at        timestamptz not null default now(),
+    unique (email, park_place_id)
+);
+
+-- Keyset pagination of a user's history and the daily demo count
+create index if not exists history_email_created_idx
+    on history (email, created_at desc, park_place_id desc);
+
+-- -----------------------------
+-- Shared caches (optional)
+-- -----------------------------
+create table if not exists place_details_cache (
+    place_id    text primary key,
+    payload     jsonb       not null,
+    fetched_at  timestamptz not null default now()
+);
+
+create table if not exists text_search_cache (
+    cache_key   text primary key,
+    payload     jsonb       not null,
+    fetched_at  timestamptz not null default now()
+);
+
+create table if not exists site_checks (
+    site        text primary key,
+    no_booking  boolean     not null,
+    booking_hit text        not null default '',
+    pad_count   integer,
+    checked_at  timestamptz not null default now()
+);
+
+-- -----------------------------
+-- RPCs (optional)
+-- -----------------------------
+-- (unlocked, history rows created today UTC) in one query
+create or replace function profile_status(p_email text)
+returns table (unlocked boolean, used_today integer)
+language sql stable as $$
+    select
+        coalesce((select p.unlocked from profiles p where p.email = p_email), false),
+        (select count(*)::integer from history h
+          where h.email = p_email
+            and h.created_at >= date_trunc('day', now() at time zone 'utc') at time zone 'utc');
+$$;
+
+-- Atomic bump of the legacy all-time counter
+create or replace function increment_leads(p_email text, p_n integer)
+returns void
+language sql as $$
+    update profiles set leads_used = leads_used + p_n where email = p_email;
+$$;
+
+-- History upsert + counter bump in one transaction; p_rows is db._history_payload()
+create or replace function record_history_and_increment(p_email text, p_rows jsonb, p_n integer)
+returns void
+language plpgsql as $$
+begin
+    insert into history (email, park_place_id, park_name, phone, website, address,
+                         city, state, zip, source, detected_keyword, pad_count)
+    select p_email, r.park_place_id, coalesce(r.park_name, ''), coalesce(r.phone, ''),
+           coalesce(r.website, ''), coalesce(r.address, ''), coalesce(r.city, ''),
+           coalesce(r.state, ''), coalesce(r.zip, ''), coalesce(r.source, 'Google Places'),
+           coalesce(r.detected_keyword, ''), coalesce(r.pad_count, '')
+      from jsonb_to_recordset(p_rows) as r(
+           park_place_id text, park_name text, phone text, website text, address text,
+           city text, state text, zip text, source text, detected_keyword text, pad_count text)
+     where coalesce(r.park_place_id, '') <> ''
+    on conflict (email, park_place_id) do update set
+        park_name = excluded.park_name, phone = excluded.phone, website = excluded.website,
+        address = excluded.address, city = excluded.city, state = excluded.state,
+        zip = excluded.zip, source = excluded.source,
+        detected_keyword = excluded.detected_keyword, pad_count = excluded.pad_count;
+
+    update profiles set leads_used = leads_used + p_n where email = p_email;
+end;
+$$;